@@ -11,7 +11,14 @@ class Duck(PWModel):
 
     @classmethod
     def bind(cls, engine):
-        super().bind(engine, primary_key="duck_id", unique=["name"])
+        # children used to be pickled into the row, the test.db of older
+        # versions of this example has to be deleted before running it
+        super().bind(
+            engine,
+            primary_key="duck_id",
+            unique=["name"],
+            relations={"children": None},
+        )
 
     def quack(self):
         print(f"Hi! I am {self.name} age {self.age} quack!")
@@ -0,0 +1,124 @@
+import os
+from typing import Any, BinaryIO, ContextManager, Iterator
+
+from pydantic_core import core_schema
+
+from pwdantic.exceptions import PWUnstoredBlobError
+
+CHUNK_SIZE = 1 << 20
+
+
+def _source_size(source: Any) -> int:
+    if hasattr(source, "read"):
+        position = source.tell()
+        size = source.seek(0, os.SEEK_END) - position
+        source.seek(position)
+        return size
+    return memoryview(source).nbytes
+
+
+class LargeBinary:
+    """Handle of a large bytes value, read and written in chunks
+
+    Fields annotated with it are stored in their own BLOB column, which
+    is never selected with the rest of the row, so loaded objects only
+    hold the handle and its size. A handle created from bytes-like data
+    or a seekable binary file is written by the next save of its object,
+    a chunk at a time. Loaded handles read the stored value through a
+    blob handle of the engine.
+    """
+
+    def __init__(self, source: Any = None, size: int | None = None):
+        self._source = source
+        if size is None and source is not None:
+            size = _source_size(source)
+        self.size = size if size is not None else 0
+        # (engine, table, column, primary key, key) of the stored value
+        self._location: tuple | None = None
+
+    @classmethod
+    def _validate(cls, value: Any) -> "LargeBinary":
+        if isinstance(value, LargeBinary):
+            return value
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return cls(value)
+        if hasattr(value, "read") and hasattr(value, "seek"):
+            return cls(value)
+        raise ValueError("LargeBinary takes bytes-like data or a binary file")
+
+    @classmethod
+    def __get_pydantic_core_schema__(
+        cls, source: Any, handler: Any
+    ) -> core_schema.CoreSchema:
+        return core_schema.no_info_plain_validator_function(
+            cls._validate,
+            serialization=core_schema.plain_serializer_function_ser_schema(
+                lambda value: value.read(), when_used="json"
+            ),
+        )
+
+    @classmethod
+    def __get_pydantic_json_schema__(
+        cls, schema: core_schema.CoreSchema, handler: Any
+    ) -> dict[str, Any]:
+        return {"type": "string", "format": "large-binary"}
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __repr__(self) -> str:
+        return f"LargeBinary(size={self.size})"
+
+    @property
+    def stored(self) -> bool:
+        return self._location is not None
+
+    def _bind(
+        self, engine: Any, table: str, column: str, primary_key: str, key: Any
+    ):
+        self._location = (engine, table, column, primary_key, key)
+        # written data is read back from the database from now on
+        self._source = None
+
+    def open(self) -> ContextManager[Any]:
+        """The stored value as a read only, file-like sqlite3.Blob"""
+        if self._location is None:
+            raise PWUnstoredBlobError()
+        engine, table, column, primary_key, key = self._location
+        return engine.open_blob(table, column, primary_key, key)
+
+    def chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        if self._location is not None:
+            with self.open() as blob:
+                while True:
+                    chunk = blob.read(chunk_size)
+                    if len(chunk) < 1:
+                        return
+                    yield chunk
+
+        elif hasattr(self._source, "read"):
+            while True:
+                chunk = self._source.read(chunk_size)
+                if len(chunk) < 1:
+                    return
+                yield chunk
+
+        elif self._source is not None:
+            # slices of the data itself, nothing is copied
+            data = memoryview(self._source).cast("B")
+            for start in range(0, len(data), chunk_size):
+                yield data[start : start + chunk_size]
+
+    def read(self) -> bytes:
+        if self._location is not None:
+            with self.open() as blob:
+                return blob.read()
+        return b"".join(self.chunks())
+
+    def copy_to(self, file: BinaryIO, chunk_size: int = CHUNK_SIZE) -> int:
+        """Writes the value to a binary file, returns the bytes written"""
+        written = 0
+        for chunk in self.chunks(chunk_size):
+            file.write(chunk)
+            written += len(chunk)
+        return written
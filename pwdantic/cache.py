@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+
+cache_key = tuple[str, str, tuple]
+
+
+class QueryCache:
+    """Read-through cache of select results, shared by all users of an engine
+
+    Entries are keyed by (table, sql, params). The least recently used
+    entry is evicted once max_size is reached, and entries expire ttl
+    seconds after they were stored. Writes through the engine drop every
+    entry of the table they touched, writes made by other processes are
+    only seen once the entries expire.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 1024,
+        ttl: float | None = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+
+        self._entries: OrderedDict[cache_key, tuple[float, list]] = (
+            OrderedDict()
+        )
+        self._tables: dict[str, set[cache_key]] = {}
+        self._generations: dict[str, int] = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _remove(self, key: cache_key):
+        del self._entries[key]
+        keys = self._tables[key[0]]
+        keys.discard(key)
+        if len(keys) < 1:
+            del self._tables[key[0]]
+
+    def _generation(self, table: str) -> tuple[int, int]:
+        return (self._epoch, self._generations.get(table, 0))
+
+    def generation(self, table: str) -> tuple[int, int]:
+        """Changed by every invalidation of table, see put()"""
+        with self._lock:
+            return self._generation(table)
+
+    def get(self, key: cache_key) -> list[Any] | None:
+        with self._lock:
+            entry = self._entries.get(key, None)
+
+            if entry is not None and self.ttl is not None:
+                if self.clock() - entry[0] > self.ttl:
+                    self._remove(key)
+                    self.expirations += 1
+                    entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[1])
+
+    def put(
+        self, key: cache_key, rows: list[Any], generation: tuple[int, int]
+    ):
+        """Stores rows read while the table was at the given generation
+
+        Rows read before a write to the table was invalidated are
+        dropped, they may predate the write.
+        """
+        with self._lock:
+            if self._generation(key[0]) != generation:
+                return
+
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (self.clock(), list(rows))
+            self._tables.setdefault(key[0], set()).add(key)
+
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, table: str):
+        with self._lock:
+            self._generations[table] = self._generations.get(table, 0) + 1
+            for key in list(self._tables.get(table, ())):
+                self._remove(key)
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+            self._tables.clear()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
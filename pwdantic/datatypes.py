@@ -1,5 +1,6 @@
 import abc
-from typing import Any
+import re
+from typing import Any, Callable, ContextManager, Iterable, Iterator
 from enum import Enum
 
 
@@ -42,6 +43,90 @@ class SQLColumn:
         return f"{self.datatype}{self.nullable}{self.default}{self.primary_key}{self.unique}"
 
 
+class SQLIndex:
+    prefix = "_pw_idx_"
+
+    def __init__(
+        self,
+        table: str,
+        columns: list[str],
+        unique: bool = False,
+        paths: list[str | None] | None = None,
+    ):
+        self.table: str = table
+        self.columns: list[str] = list(columns)
+        self.unique: bool = unique
+        # JSON path indexed per column, None indexes the column itself
+        self.paths: list[str | None] = (
+            list(paths) if paths is not None else [None] * len(self.columns)
+        )
+
+        parts = []
+        for column, path in zip(self.columns, self.paths):
+            if path is None:
+                parts.append(column)
+            else:
+                path_name = re.sub(r"\W+", "_", path).strip("_")
+                parts.append(f"{column}_{path_name}")
+        self.name: str = f"{self.prefix}{table}_{'_'.join(parts)}"
+
+    def __str__(self):
+        return f"{self.name}: {('unique ' if self.unique else '')}({', '.join(self.columns)})"
+
+    def signature(self):
+        if any(x is not None for x in self.paths):
+            return f"{self.columns}{self.paths}{self.unique}"
+        return f"{self.columns}{self.unique}"
+
+
+class SQLCondition:
+    lookups = ("eq", "ne", "lt", "lte", "gt", "gte", "in", "contains", "path")
+    # lookups into json columns, path takes a (json path, value) tuple
+    json_lookups = ("contains", "path")
+
+    def __init__(self, field: str, lookup: str, value: Any):
+        self.field = field
+        self.lookup = lookup
+        self.value = value
+
+    def __str__(self) -> str:
+        return f"{self.field} {self.lookup} {self.value!r}"
+
+    @classmethod
+    def parse(cls, key: str, value: Any) -> "SQLCondition":
+        """Parses a keyword filter such as age__gt=10"""
+        field, _, lookup = key.rpartition("__")
+        if lookup not in cls.lookups:
+            return cls(key, "eq", value)
+
+        return cls(field, lookup, value)
+
+
+class SQLQuery:
+    # functions aggregate_query() accepts, applied to a column or "*"
+    aggregates = ("count", "sum", "avg", "min", "max")
+
+    def __init__(
+        self,
+        table: str,
+        field: str = "*",
+        conditions: list[SQLCondition] | None = None,
+        order: list[tuple[str, bool]] | None = None,
+        limit: int | None = None,
+        offset: int | None = None,
+        after: tuple | None = None,
+    ):
+        self.table = table
+        self.field = field
+        self.conditions = conditions if conditions is not None else []
+        # (column, descending) pairs
+        self.order = order if order is not None else []
+        self.limit = limit
+        self.offset = offset
+        # keyset pagination, values of the order columns of the last row
+        self.after = after
+
+
 class InvalidMigrationError(Exception):
     pass
 
@@ -90,11 +175,15 @@ class RetypeCol(DesctructiveMigrationStep):
 
 
 class AddConstraint(MigrationStep):
-    def __init__(self, column_name: str, constraint: str):
+    def __init__(self, column_name: str, constraint: str | SQLConstraint):
         self.column_name = column_name
-        self.constraint = constraint
+        self.constraint = (
+            constraint.value
+            if isinstance(constraint, SQLConstraint)
+            else constraint
+        )
 
-        if constraint == SQLConstraint.primary:
+        if self.constraint == SQLConstraint.primary.value:
             self._destructive = True
 
     def __str__(self) -> str:
@@ -102,11 +191,15 @@ class AddConstraint(MigrationStep):
 
 
 class RemoveConstraint(MigrationStep):
-    def __init__(self, column_name: str, constraint: str):
+    def __init__(self, column_name: str, constraint: str | SQLConstraint):
         self.column_name = column_name
-        self.constraint = constraint
+        self.constraint = (
+            constraint.value
+            if isinstance(constraint, SQLConstraint)
+            else constraint
+        )
 
-        if constraint == SQLConstraint.primary:
+        if self.constraint == SQLConstraint.primary.value:
             self._destructive = True
 
     def __str__(self) -> str:
@@ -124,6 +217,22 @@ class ChangeDefault(MigrationStep):
 
 
 
+class AddIndex(MigrationStep):
+    def __init__(self, index: SQLIndex):
+        self.index = index
+
+    def __str__(self) -> str:
+        return f"ADD INDEX {self.index.name}"
+
+
+class DropIndex(MigrationStep):
+    def __init__(self, index_name: str):
+        self.index_name = index_name
+
+    def __str__(self) -> str:
+        return f"DROP INDEX {self.index_name}"
+
+
 class Migration:
     def __init__(self, table: str, steps: list[MigrationStep]):
         self.table = table
@@ -134,7 +243,10 @@ class Migration:
 
     @staticmethod
     def _step_key_function(step: MigrationStep):
-        if type(step) == AddCol:
+        if type(step) == DropIndex:
+            return 0
+
+        elif type(step) == AddCol:
             return 1
 
         elif type(step) == RetypeCol:
@@ -152,6 +264,9 @@ class Migration:
         elif type(step) == RenameCol:
             return 5
 
+        elif type(step) == AddIndex:
+            return 6
+
         return 0
 
     def sort(self):
@@ -159,16 +274,88 @@ class Migration:
 
 
 class PWEngine(abc.ABC):
+    # bound parameters a single statement may take
+    max_variables: int = 999
 
     def select(
         self, field: str, table: str, conditions: dict[str, Any] | None = None
     ) -> list[Any]:
         pass
 
-    def insert(self, table: str, data: list[tuple]):
+    def select_iter(
+        self,
+        field: str,
+        table: str,
+        conditions: dict[str, Any] | None = None,
+        batch_size: int = 1000,
+    ) -> Iterator[Any]:
+        pass
+
+    def select_query(self, query: SQLQuery) -> list[Any]:
+        pass
+
+    def select_query_iter(
+        self, query: SQLQuery, batch_size: int = 1000
+    ) -> Iterator[Any]:
+        pass
+
+    def aggregate_query(
+        self,
+        query: SQLQuery,
+        aggregates: list[tuple[str, str]],
+        group_by: list[str] = [],
+    ) -> list[tuple]:
+        pass
+
+    def insert(self, table: str, obj_data: dict[str, Any]) -> int:
+        pass
+
+    def insert_many(
+        self, table: str, rows: list[dict[str, Any]], chunk_size: int = 500
+    ) -> list[int]:
+        pass
+
+    def upsert_many(
+        self,
+        table: str,
+        rows: list[dict[str, Any]],
+        conflict: list[str],
+        primary_key: str,
+        chunk_size: int = 500,
+    ) -> list[Any]:
+        pass
+
+    def update_query(self, query: SQLQuery, obj_data: dict[str, Any]) -> int:
         pass
 
-    def migrate(self, table: str, columns: list[SQLColumn]):
+    def open_blob(
+        self, table: str, column: str, primary_key: str, key: Any
+    ) -> ContextManager[Any]:
+        pass
+
+    def write_blob(
+        self,
+        table: str,
+        column: str,
+        primary_key: str,
+        key: Any,
+        chunks: Iterable[Any],
+        size: int,
+    ):
+        pass
+
+    def delete_query(self, query: SQLQuery) -> int:
+        pass
+
+    def migrate(
+        self,
+        table: str,
+        columns: list[SQLColumn],
+        indexes: list[SQLIndex] | None = None,
+    ):
+        pass
+
+    def schema_snapshot(self) -> ContextManager["PWEngine"]:
         pass
 
     def update(self, table: str, obj_data: dict[str, Any], primary_key: str):
@@ -177,5 +364,18 @@ class PWEngine(abc.ABC):
     def delete(self, table: str, key: str, value: Any):
         pass
 
-    def execute_migration(self, migration: Migration, force: bool = False):
+    def execute_migration(
+        self,
+        migration: Migration,
+        force: bool = False,
+        converters: dict[str, Callable[[Any], Any]] | None = None,
+        chunk_size: int = 1000,
+        progress: Callable[[int], None] | None = None,
+    ):
+        pass
+
+    def transaction(self) -> ContextManager["PWEngine"]:
+        pass
+
+    def on_rollback(self, callback: Callable[[], None]):
         pass
@@ -39,3 +39,46 @@ class PWDestructiveMigrationError(Exception):
 class PWInvalidMigrationError(Exception):
     def __init__(self):
         super().__init__("This migration is not valid")
+
+
+class PWInvalidQueryError(Exception):
+    def __init__(self):
+        super().__init__("This query references an unknown field or lookup")
+
+
+class PWInvalidIndexError(Exception):
+    def __init__(self):
+        super().__init__("This index references an unknown column")
+
+
+class PWNoAsyncEngineError(Exception):
+    def __init__(self):
+        super().__init__(
+            "The async API needs a model bound to an AsyncSqliteEngine"
+        )
+
+
+class PWInvalidCodecError(Exception):
+    def __init__(self):
+        super().__init__(
+            "This codec is unknown, not installed or set on an unknown field"
+        )
+
+
+class PWInvalidRelationError(Exception):
+    def __init__(self):
+        super().__init__(
+            "Relations have to be list fields of models, with foreign keys "
+            "that are fields of the related model"
+        )
+
+
+class PWMissingKeysError(Exception):
+    def __init__(self, missing: list):
+        self.missing = missing
+        super().__init__(f"No objects exist for the keys {missing}")
+
+
+class PWUnstoredBlobError(Exception):
+    def __init__(self):
+        super().__init__("This LargeBinary value has not been saved yet")
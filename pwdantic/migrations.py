@@ -1,9 +1,27 @@
-from pwdantic.serialization import SQLColumn
+from pwdantic.serialization import SQLColumn, ColumnCodec, GeneralSQLSerializer
 from pwdantic.datatypes import *
 from copy import deepcopy
+from typing import Any, Callable
 from pwdantic.exceptions import PWInvalidMigrationError
 
 
+def _recoder(
+    old: ColumnCodec | None, new: ColumnCodec | None
+) -> Callable[[Any], Any]:
+    """Decodes a stored value with old and encodes it with new"""
+
+    def recode(value: Any) -> Any:
+        if value is None:
+            return None
+        if old is not None:
+            value = old.loads(value)
+        if new is not None:
+            value = new.dumps(value)
+        return value
+
+    return recode
+
+
 class MigrationEngine:
     def get_col_diff(
         self, old_col: SQLColumn, new_col: SQLColumn
@@ -11,11 +29,16 @@ class MigrationEngine:
         steps = []
 
         if old_col.datatype != new_col.datatype:
-            steps.append(
-                RetypeCol(new_col.name, old_col.datatype, new_col.datatype)
+            retype = RetypeCol(
+                new_col.name, old_col.datatype, new_col.datatype
             )
+            # switching codecs re-encodes the values, nothing is lost
+            codec_for = GeneralSQLSerializer.codec_for_datatype
+            if codec_for(old_col.datatype) and codec_for(new_col.datatype):
+                retype._destructive = False
+            steps.append(retype)
 
-        if old_col.datatype == "string":
+        if old_col.datatype == "string" and old_col.default is not None:
             old_col.default = old_col.default.strip("'").strip('"')
 
         if old_col.default != new_col.default:
@@ -57,12 +80,38 @@ class MigrationEngine:
 
         return steps
 
+    def get_index_diff(
+        self, original: list[SQLIndex], new: list[SQLIndex]
+    ) -> list[MigrationStep]:
+        steps = []
+
+        current = {x.name: x.signature() for x in original}
+        wanted = {x.name: x.signature() for x in new}
+
+        for index in original:
+            if wanted.get(index.name, None) != index.signature():
+                steps.append(DropIndex(index.name))
+
+        for index in new:
+            if current.get(index.name, None) != index.signature():
+                steps.append(AddIndex(index))
+
+        return steps
+
     def generate_migration(
-        self, table: str, original: list[SQLColumn], new: list[SQLColumn]
+        self,
+        table: str,
+        original: list[SQLColumn],
+        new: list[SQLColumn],
+        original_indexes: list[SQLIndex] | None = None,
+        new_indexes: list[SQLIndex] | None = None,
     ) -> Migration:
 
         steps = []
 
+        if original_indexes is not None and new_indexes is not None:
+            steps += self.get_index_diff(original_indexes, new_indexes)
+
         current_names = [x.name for x in original]
         matched_cols = [x for x in new if x.name in current_names]
 
@@ -89,7 +138,7 @@ class MigrationEngine:
                 steps.append(AddCol(added_col))
 
         for to_be_dropped in removed:
-            steps.append(DropCol(to_be_dropped))
+            steps.append(DropCol(to_be_dropped.name))
 
         result = Migration(table, steps)
         result.sort()
@@ -103,6 +152,40 @@ class MigrationEngine:
                 mapping[step.old_name] = step.new_name
         return mapping
 
+    def get_converters(
+        self, migration: Migration
+    ) -> dict[str, Callable[[Any], Any]]:
+        """Python conversions needed when copying rows into the new table"""
+        converters = {}
+
+        for step in migration.steps:
+            if type(step) != RetypeCol:
+                continue
+
+            old = GeneralSQLSerializer.codec_for_datatype(step.old_type)
+            new = GeneralSQLSerializer.codec_for_datatype(step.new_type)
+            if old is not None or new is not None:
+                converters[step.column_name] = _recoder(old, new)
+
+        return converters
+
+    def get_migrated_indexes(
+        self, original: list[SQLIndex], migration: Migration
+    ) -> list[SQLIndex]:
+
+        new_indexes = [deepcopy(x) for x in original]
+
+        for step in migration.steps:
+            if type(step) == DropIndex:
+                new_indexes = [
+                    x for x in new_indexes if x.name != step.index_name
+                ]
+
+            elif type(step) == AddIndex:
+                new_indexes.append(step.index)
+
+        return new_indexes
+
     def get_migrated_cols(
         self, original: list[SQLColumn], migration: Migration
     ) -> list[SQLColumn]:
@@ -115,9 +198,7 @@ class MigrationEngine:
                 new_cols.append(step.column)
 
             elif type(step) == DropCol:
-                new_cols = filter(
-                    lambda x: x.name != step.column_name, new_cols
-                )
+                new_cols = [x for x in new_cols if x.name != step.column_name]
 
             elif type(step) == RenameCol:
                 for col in new_cols:
@@ -141,11 +222,13 @@ class MigrationEngine:
                     if step.constraint == SQLConstraint.primary.value:
                         if (
                             len(
-                                filter(
-                                    lambda x: type(x) == RemoveConstraint
-                                    and x.constraint == SQLConstraint.primary,
-                                    migration.steps,
-                                )
+                                [
+                                    x
+                                    for x in migration.steps
+                                    if type(x) == RemoveConstraint
+                                    and x.constraint
+                                    == SQLConstraint.primary.value
+                                ]
                             )
                             != 1
                         ):
@@ -156,18 +239,20 @@ class MigrationEngine:
                 for col in new_cols:
                     if col.name != step.column_name:
                         continue
-                    if step.constraint == SQLConstraint.nullable:
+                    if step.constraint == SQLConstraint.nullable.value:
                         col.nullable = False
-                    if step.constraint == SQLConstraint.unique:
+                    if step.constraint == SQLConstraint.unique.value:
                         col.unique = False
-                    if step.constraint == SQLConstraint.primary:
+                    if step.constraint == SQLConstraint.primary.value:
                         if (
                             len(
-                                filter(
-                                    lambda x: type(x) == AddConstraint
-                                    and x.constraint == SQLConstraint.primary,
-                                    migration.steps,
-                                )
+                                [
+                                    x
+                                    for x in migration.steps
+                                    if type(x) == AddConstraint
+                                    and x.constraint
+                                    == SQLConstraint.primary.value
+                                ]
                             )
                             != 1
                         ):
@@ -1,22 +1,76 @@
 from pydantic import BaseModel
 import abc
-import sqlite3
-from typing import Any, Self
+import asyncio
+import contextvars
+from contextlib import nullcontext
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    ContextManager,
+    Iterable,
+    Iterator,
+    Self,
+    get_args,
+    get_origin,
+)
 
 from pwdantic.exceptions import *
-from pwdantic.sqlite import SqliteEngine
-from pwdantic.datatypes import PWEngine, SQLColumn
+from pwdantic.sqlite import (
+    SqliteEngine,
+    SqliteProfile,
+    PooledSqliteEngine,
+    AsyncSqliteEngine,
+    get_profile,
+)
+from pwdantic.datatypes import (
+    PWEngine,
+    SQLColumn,
+    SQLCondition,
+    SQLIndex,
+    SQLQuery,
+)
+from pwdantic.cache import QueryCache
+from pwdantic.blob import LargeBinary
 
 from pwdantic.serialization import GeneralSQLSerializer
+from pwdantic.query import PWQuery, _chunks
+from pwdantic.session import PWSession, current_session
+from pwdantic.relations import PWRelation
 
 DEFAULT_PRIM_KEYS = ["id", "primary_key", "uuid"]
 
 
 class PWEngineFactory(abc.ABC):
     @staticmethod
-    def create_sqlite3_engine(database: str = "") -> PWEngine:
-        conn = sqlite3.connect(database)
-        return SqliteEngine(conn)
+    def create_sqlite3_engine(
+        database: str = "",
+        profile: str | SqliteProfile | None = None,
+        cache: QueryCache | None = None,
+    ) -> PWEngine:
+        profile = get_profile(profile)
+        conn = profile.connect(database)
+        return SqliteEngine(conn, profile, cache)
+
+    @staticmethod
+    def create_pooled_sqlite3_engine(
+        database: str,
+        size: int = 4,
+        timeout: float = 30.0,
+        profile: str | SqliteProfile | None = None,
+        cache: QueryCache | None = None,
+    ) -> PWEngine:
+        return PooledSqliteEngine(database, size, timeout, profile, cache)
+
+    @staticmethod
+    def create_async_sqlite3_engine(
+        database: str = "",
+        max_batch: int = 256,
+        profile: str | SqliteProfile | None = None,
+        cache: QueryCache | None = None,
+    ) -> PWEngine:
+        return AsyncSqliteEngine(database, max_batch, profile, cache)
 
 
 def bound(func):
@@ -36,15 +90,32 @@ class PWModel(BaseModel):
         db: PWEngine,
         primary_key: str | None = None,
         unique: list[str] = [],
-        table: str = None
+        table: str = None,
+        indexes: list[tuple[str, ...]] = [],
+        trusted: bool = False,
+        codecs: dict[str, str] = {},
+        json_indexes: list[tuple[str, str]] = [],
+        relations: dict[str, str | None] = {},
     ):
         cls.db = db
         table = table if table is not None else cls.__name__
+        # loaded rows skip validation, see PWQuery.trusted()
+        cls._trusted = trusted
+
+        # fields stored through another codec than pickle
+        if any(x not in cls.model_fields for x in codecs):
+            raise PWInvalidCodecError()
 
+        # self referencing models only have their schema under $defs
+        schema = cls.model_json_schema()
+        if "properties" not in schema.keys():
+            schema = schema["$defs"][cls.__name__]
 
         columns = GeneralSQLSerializer().serialize_schema(
-            table, cls.model_json_schema(), primary_key, unique
+            table, schema, primary_key, unique, codecs
         )
+        # relation fields are not stored in the row, see PWRelation
+        columns = [x for x in columns if x.name not in relations]
 
         if primary_key is None:
             for prim in DEFAULT_PRIM_KEYS:
@@ -56,67 +127,597 @@ class PWModel(BaseModel):
         cls._primary = primary_key
 
         cls.table = table
+        cls._codec = GeneralSQLSerializer().compile_codec(
+            cls, table, columns
+        )
+
+        column_names = [x.name for x in columns]
+        sql_indexes = []
+        for index_columns in indexes:
+            if any(x not in column_names for x in index_columns):
+                raise PWInvalidIndexError()
+            sql_indexes.append(SQLIndex(table, index_columns))
+
+        # expression indexes on a JSON path of a json codec column
+        for column, path in json_indexes:
+            if codecs.get(column, None) != "json" or not path.startswith("$"):
+                raise PWInvalidIndexError()
+            sql_indexes.append(SQLIndex(table, [column], paths=[path]))
+
+        db.migrate(table, columns, sql_indexes)
+
+        key_type = cls._codec.datatypes[primary_key]
+        cls._relations = {}
+        for name, foreign_key in relations.items():
+            relation = cls._bind_relation(name, foreign_key)
+            cls._relations[name] = relation
+
+            if foreign_key is None:
+                related = relation.related
+                if related is not cls and "db" not in dir(related):
+                    raise PWNoBindError()
+                related_type = (
+                    key_type
+                    if related is cls
+                    else related._codec.datatypes[related._primary]
+                )
+                db.migrate(
+                    relation.link_table,
+                    relation.link_columns(key_type, related_type),
+                    relation.link_indexes(),
+                )
+
+    @classmethod
+    def _bind_relation(cls, name: str, foreign_key: str | None) -> PWRelation:
+        field = cls.model_fields.get(name, None)
+        if field is None or get_origin(field.annotation) != list:
+            raise PWInvalidRelationError()
+
+        related = get_args(field.annotation)[0]
+        if not isinstance(related, type) or not issubclass(related, PWModel):
+            raise PWInvalidRelationError()
+        if foreign_key is not None and foreign_key not in related.model_fields:
+            raise PWInvalidRelationError()
+
+        return PWRelation(cls, name, related, foreign_key)
+
+    @staticmethod
+    def bind_all(db: PWEngine, models: Iterable[type["PWModel"]]):
+        """Binds every model, reading the database schema only once
+
+        Each model is bound through its own bind(db) override.
+        """
+        with db.schema_snapshot():
+            for model in models:
+                model.bind(db)
+
+    @classmethod
+    def _from_row(
+        cls,
+        row: tuple,
+        trusted: bool | None = None,
+        columns: list[str] | None = None,
+    ) -> Self:
+        """Object of a selected row, columns are the ones row holds"""
+        codec = cls._codec
+        primary_index = (
+            codec.primary_index
+            if columns is None
+            else columns.index(cls._primary)
+        )
+        session = current_session()
+        if session is not None and primary_index is not None:
+            cached = session.get(cls.table, row[primary_index])
+            if cached is not None:
+                return cached
+
+        trusted = cls._trusted if trusted is None else trusted
+        if columns is None:
+            object = codec.decode(row, trusted)
+        else:
+            object = codec.decode_partial(columns, row, trusted)
+            deferred = [x for x in codec.columns if x not in columns]
+            setattr(object, "_pw_deferred", deferred)
+        setattr(object, "_data_bind", getattr(object, cls._primary))
+        object._bind_blobs(codec.large)
+        setattr(object, "_pw_snapshot", codec.snapshot(object, row, columns))
+        # relations are loaded on first access
+        for name in cls._relations:
+            object.__dict__.pop(name, None)
+
+        if session is not None:
+            session.add(cls.table, object._data_bind, object)
+        return object
+
+    def __getattr__(self, name: str) -> Any:
+        relation = getattr(type(self), "_relations", {}).get(name, None)
+        if relation is not None and self.__dict__.get("_data_bind") != None:
+            relation.prefetch([self])
+            return self.__dict__[name]
+
+        if name in self.__dict__.get("_pw_deferred", ()):
+            self._load_deferred()
+            if name in self.__dict__:
+                return self.__dict__[name]
+
+        return super().__getattr__(name)
+
+    def _load_deferred(self):
+        # every deferred column of the object is loaded on first access
+        cls = self.__class__
+        columns = self.__dict__.pop("_pw_deferred")
+        rows = cls.db.select_query(
+            SQLQuery(
+                cls.table,
+                cls._codec.select_fields(columns),
+                [SQLCondition(cls._primary, "eq", self._data_bind)],
+            )
+        )
+        if len(rows) < 1:
+            return
+
+        values = cls._codec.decode_values(columns, rows[0], cls._trusted)
+        self.__dict__.update(values)
+        self.__pydantic_fields_set__.update(values)
+        self._bind_blobs([x for x in columns if x in cls._codec.large])
+        self._pw_snapshot.update(cls._codec.snapshot(self, rows[0], columns))
+
+    def _bind_blobs(self, names: list[str]):
+        # handles decoded from a row read their value from that row
+        cls = self.__class__
+        for name in names:
+            value = self.__dict__.get(name, None)
+            if value is not None:
+                key = self._data_bind
+                value._bind(cls.db, cls.table, name, cls._primary, key)
+
+    def _write_blobs(self):
+        # LargeBinary values are written after their row, in chunks
+        cls = self.__class__
+        for name in cls._codec.large:
+            if name not in self.__dict__:
+                continue
+
+            value = self.__dict__[name]
+            # assignments are not validated, bytes may have been set
+            if value is not None and not isinstance(value, LargeBinary):
+                value = LargeBinary._validate(value)
+                self.__dict__[name] = value
 
-        db.migrate(table, columns)
+            location = (cls.db, cls.table, name, cls._primary, self._data_bind)
+            if value is not None and value._location != location:
+                cls.db.write_blob(
+                    cls.table,
+                    name,
+                    cls._primary,
+                    self._data_bind,
+                    value.chunks(),
+                    value.size,
+                )
+                # a value copied from another row, that one keeps its handle
+                if value.stored:
+                    value = LargeBinary(size=value.size)
+                    self.__dict__[name] = value
+                value._bind(*location)
+
+            self._pw_snapshot[name] = value
+
+    def _remember(self):
+        session = current_session()
+        if session is not None:
+            session.add(self.__class__.table, self._data_bind, self)
+
+    @classmethod
+    def _linking(cls) -> list[PWRelation]:
+        # link table relations of any model the rows of this one are in
+        return PWRelation.linking(cls)
+
+    @classmethod
+    @bound
+    def atomic(cls) -> ContextManager[PWEngine]:
+        return cls.db.transaction()
 
     @classmethod
     @bound
     def get(cls, **kwargs) -> Self:
-        data = cls.db.select("*", cls.table, kwargs)
-        if len(data) < 1:
-            return None
-        object = GeneralSQLSerializer().deserialize_object(cls, data[0])
-        setattr(
-            object, "_data_bind", getattr(object, object.__class__._primary)
+        session = current_session()
+        if session is not None and list(kwargs.keys()) == [cls._primary]:
+            cached = session.get(cls.table, kwargs[cls._primary])
+            if cached is not None:
+                return cached
+
+        return cls.where(**kwargs).first()
+
+    @classmethod
+    @bound
+    def get_many(
+        cls, keys: Iterable[Any], as_dict: bool = False, strict: bool = False
+    ) -> list[Self | None] | dict[Any, Self]:
+        """Loads the objects with the given primary keys
+
+        Returns them in the order of keys, with None for keys that do not
+        exist, or as a dict of the found ones. strict raises
+        PWMissingKeysError listing the missing keys instead.
+        """
+        keys = list(keys)
+        wanted = list(dict.fromkeys(keys))
+        found = {}
+
+        session = current_session()
+        if session is not None:
+            for key in wanted:
+                cached = session.get(cls.table, key)
+                if cached is not None:
+                    found[key] = cached
+            wanted = [x for x in wanted if x not in found]
+
+        for chunk in _chunks(wanted, cls.db.max_variables):
+            query = cls.where(**{f"{cls._primary}__in": chunk})
+            for obj in query.all():
+                found[obj._data_bind] = obj
+
+        if strict:
+            missing = [x for x in dict.fromkeys(keys) if x not in found]
+            if len(missing) > 0:
+                raise PWMissingKeysError(missing)
+
+        if as_dict:
+            return {x: found[x] for x in dict.fromkeys(keys) if x in found}
+        return [found.get(x, None) for x in keys]
+
+    @classmethod
+    @bound
+    def where(cls, **kwargs) -> PWQuery:
+        return PWQuery(cls).where(**kwargs)
+
+    @classmethod
+    @bound
+    def count(cls, **kwargs) -> int:
+        return cls.where(**kwargs).count()
+
+    @classmethod
+    @bound
+    def exists(cls, **kwargs) -> bool:
+        return cls.where(**kwargs).exists()
+
+    @classmethod
+    @bound
+    def aggregate(
+        cls, group_by: str | list[str] | None = None, **aggregates: str
+    ) -> Any:
+        """See PWQuery.aggregate(), filter through where() first"""
+        return PWQuery(cls).aggregate(group_by, **aggregates)
+
+    @classmethod
+    @bound
+    def columns(
+        cls, *fields: str, batch_size: int = 1000, as_numpy: bool = True
+    ) -> dict[str, Any]:
+        """See PWQuery.columns(), filter through where() first"""
+        return PWQuery(cls).columns(
+            *fields, batch_size=batch_size, as_numpy=as_numpy
         )
-        return object
+
+    @classmethod
+    @bound
+    def only(cls, *fields: str) -> PWQuery:
+        return PWQuery(cls).only(*fields)
+
+    @classmethod
+    @bound
+    def defer(cls, *fields: str) -> PWQuery:
+        return PWQuery(cls).defer(*fields)
 
     def _create(self):
-        obj_data = GeneralSQLSerializer().serialize_object(self)
+        obj_data = self.__class__._codec.encode(self)
 
         insert_bind = self.db.insert(self.__class__.table, obj_data)
-        bind_attr = getattr(self, self.__class__._primary)
-        data_bind = bind_attr if bind_attr != None else insert_bind
-        setattr(self, "_data_bind", data_bind)
+        self._bind_inserted(obj_data, insert_bind)
+
+    def _bind_inserted(self, obj_data: dict[str, Any], rowid: int):
+        # generated keys are filled in, so the object can be saved again
+        primary = self.__class__._primary
+        if getattr(self, primary) is None:
+            setattr(self, primary, rowid)
+            obj_data[primary] = rowid
+
+        setattr(self, "_data_bind", getattr(self, primary))
+        setattr(self, "_pw_snapshot", obj_data)
+
+    @classmethod
+    @bound
+    def save_many(cls, objects: Iterable[Self], chunk_size: int = 500):
+        objects = list(objects)
+        with cls.db.transaction():
+            new = []
+            for obj in objects:
+                obj._undo_on_rollback()
+                if getattr(obj, "_data_bind", None) is None:
+                    new.append(obj)
+                else:
+                    obj._update()
+
+            rows = [cls._codec.encode(obj) for obj in new]
+            rowids = cls.db.insert_many(cls.table, rows, chunk_size)
+
+            for obj, obj_data, rowid in zip(new, rows, rowids):
+                obj._bind_inserted(obj_data, rowid)
+
+            if len(cls._codec.large) > 0:
+                for obj in objects:
+                    obj._write_blobs()
+
+            for relation in cls._relations.values():
+                for obj in objects:
+                    if relation.name in obj.__dict__:
+                        relation.save(obj)
+
+        for obj in objects:
+            obj._remember()
+
+    @classmethod
+    @bound
+    def upsert(
+        cls,
+        objects: Iterable[Self],
+        conflict: list[str] | None = None,
+        chunk_size: int = 500,
+    ):
+        """Inserts objects, overwriting the rows they conflict with
+
+        conflict lists the unique columns rows are matched on, the primary
+        key by default. Every object is bound to the row it ended up in.
+        Objects without a value in a conflict column are refused, unless
+        it is only the generated primary key.
+        """
+        objects = list(objects)
+        conflict = [cls._primary] if conflict is None else list(conflict)
+        for name in conflict:
+            if name not in cls._codec.columns:
+                raise PWInvalidQueryError()
+
+        rows = [cls._codec.encode(obj) for obj in objects]
+        # NULLs never conflict, the rows they would insert cannot be
+        # matched back to their objects, only generated keys are found
+        if conflict != [cls._primary]:
+            for obj_data in rows:
+                if any(obj_data[x] is None for x in conflict):
+                    raise PWInvalidQueryError()
+
+        with cls.db.transaction():
+            for obj in objects:
+                obj._undo_on_rollback()
+            keys = cls.db.upsert_many(
+                cls.table, rows, conflict, cls._primary, chunk_size
+            )
+
+            for obj, obj_data, key in zip(objects, rows, keys):
+                # rows matched on another column keep their own key
+                if key is not None and getattr(obj, cls._primary) != key:
+                    setattr(obj, cls._primary, key)
+                    obj_data[cls._primary] = key
+                obj._bind_inserted(obj_data, key)
+                if len(cls._codec.large) > 0:
+                    obj._write_blobs()
+
+        for obj in objects:
+            obj._remember()
+
+    def dirty_fields(self) -> list[str]:
+        """Columns save() would write"""
+        snapshot = getattr(self, "_pw_snapshot", None)
+        if snapshot is None:
+            return list(self.__class__._codec.columns)
+        return list(self.__class__._codec.diff(self, snapshot).keys())
 
     def _update(self):
+        cls = self.__class__
         bind = self._data_bind
-        if getattr(self, self.__class__._primary) != bind:
+        if getattr(self, cls._primary) != bind:
             raise PWBindViolationError()
 
-        obj_data = GeneralSQLSerializer().serialize_object(self)
-        self.db.update(self.__class__.table, obj_data, self.__class__._primary)
+        snapshot = getattr(self, "_pw_snapshot", None)
+        if snapshot is None:
+            obj_data = cls._codec.encode(self)
+            snapshot = {}
+        else:
+            obj_data = cls._codec.diff(self, snapshot)
+            obj_data.pop(cls._primary, None)
+            if len(obj_data) < 1:
+                return
+            obj_data[cls._primary] = bind
+
+        self.db.update(cls.table, obj_data, cls._primary)
+        setattr(self, "_pw_snapshot", snapshot | obj_data)
+
+    def _undo_on_rollback(self):
+        # a rolled back write leaves the object as it was before, so it
+        # is written again by its next save
+        cls = self.__class__
+        state = {
+            name: self.__dict__[name]
+            for name in ("_data_bind", "_pw_snapshot", "_pw_relations")
+            if name in self.__dict__
+        }
+        state = {
+            name: dict(value) if type(value) == dict else value
+            for name, value in state.items()
+        }
+        key = self.__dict__.get(cls._primary, None)
+
+        blobs = {}
+        for name in cls._codec.large:
+            value = self.__dict__.get(name, None)
+            if isinstance(value, LargeBinary):
+                source = value._source
+                position = source.tell() if hasattr(source, "tell") else None
+                blobs[name] = (value, value._location, source, position)
+
+        def undo():
+            inserted = self.__dict__.get("_data_bind", None)
+            if "_data_bind" not in state and inserted is not None:
+                session = current_session()
+                if session is not None:
+                    session.discard(cls.table, inserted)
+
+            for name in ("_data_bind", "_pw_snapshot", "_pw_relations"):
+                self.__dict__.pop(name, None)
+            self.__dict__.update(state)
+            self.__dict__[cls._primary] = key
+
+            for name, (value, location, source, position) in blobs.items():
+                value._location = location
+                value._source = source
+                if position is not None:
+                    source.seek(position)
+                self.__dict__[name] = value
+
+        self.db.on_rollback(undo)
+
+    def _save_row(self):
+        large = len(self.__class__._codec.large) > 0
+        with self.db.transaction() if large else nullcontext():
+            self._undo_on_rollback()
+            if getattr(self, "_data_bind", None) is None:
+                self._create()
+            else:
+                self._update()
+            if large:
+                self._write_blobs()
+        self._remember()
 
     @bound
     def save(self):
-        if getattr(self, "_data_bind", None) is None:
-            return self._create()
-        return self._update()
+        # loaded relations are saved along, unloaded ones did not change
+        relations = [
+            x
+            for x in self.__class__._relations.values()
+            if x.name in self.__dict__
+        ]
+        if len(relations) < 1:
+            return self._save_row()
+
+        with self.db.transaction():
+            self._save_row()
+            for relation in relations:
+                relation.save(self)
 
     @bound
     def delete(self):
         if getattr(self, "_data_bind", None) is None:
             raise PWUnboundDeleteError()
+        self._undo_on_rollback()
 
+        table = self.__class__.table
         primary_key = self.__class__._primary
         primary_value = self._data_bind
 
-        self.db.delete(self.__class__.table, primary_key, primary_value)
+        relations = self.__class__._relations.values()
+        linking = self.__class__._linking()
+        if len(relations) + len(linking) < 1:
+            self.db.delete(table, primary_key, primary_value)
+        else:
+            with self.db.transaction():
+                for relation in relations:
+                    relation.delete(self)
+                # links to the object from other rows go with it as well
+                for relation in linking:
+                    relation.delete_links("child", [primary_value])
+                self.db.delete(table, primary_key, primary_value)
         self._data_bind = None
 
+        session = current_session()
+        if session is not None:
+            session.discard(self.__class__.table, primary_value)
+
     @classmethod
     @bound
     def all(cls) -> list[Self]:
-        data = cls.db.select("*", cls.table)
-
-        objects = []
-        for row in data:
-            object = GeneralSQLSerializer().deserialize_object(cls, row)
-            setattr(
-                object,
-                "_data_bind",
-                getattr(object, object.__class__._primary),
-            )
-            objects.append(object)
+        data = cls.db.select(cls._codec.fields, cls.table)
+        return [cls._from_row(row) for row in data]
+
+    @classmethod
+    @bound
+    def iter(cls, batch_size: int = 1000, **kwargs) -> Iterator[Self]:
+        return cls.where(**kwargs).iter(batch_size)
+
+    @classmethod
+    @bound
+    def _run_async(
+        cls, func: Callable, *args, write: bool = False, **kwargs
+    ) -> Awaitable:
+        submit = getattr(cls.db, "submit", None)
+        if submit is None:
+            raise PWNoAsyncEngineError()
+
+        # the engine thread runs func in the caller's context, so an
+        # active PWSession is seen there as well
+        context = contextvars.copy_context()
+        future = submit(context.run, func, *args, write=write, **kwargs)
+        return asyncio.wrap_future(future)
+
+    @classmethod
+    async def aget(cls, **kwargs) -> Self:
+        return await cls.where(**kwargs).afirst()
+
+    @classmethod
+    async def aget_many(
+        cls, keys: Iterable[Any], as_dict: bool = False, strict: bool = False
+    ) -> list[Self | None] | dict[Any, Self]:
+        keys = list(keys)
+        return await cls._run_async(cls.get_many, keys, as_dict, strict)
+
+    @classmethod
+    async def aall(cls) -> list[Self]:
+        return await cls._run_async(cls.all)
+
+    @classmethod
+    async def acolumns(
+        cls, *fields: str, batch_size: int = 1000, as_numpy: bool = True
+    ) -> dict[str, Any]:
+        return await PWQuery(cls).acolumns(
+            *fields, batch_size=batch_size, as_numpy=as_numpy
+        )
 
-        return objects
+    @classmethod
+    async def acount(cls, **kwargs) -> int:
+        return await cls.where(**kwargs).acount()
+
+    @classmethod
+    async def aexists(cls, **kwargs) -> bool:
+        return await cls.where(**kwargs).aexists()
+
+    @classmethod
+    async def aaggregate(
+        cls, group_by: str | list[str] | None = None, **aggregates: str
+    ) -> Any:
+        return await PWQuery(cls).aaggregate(group_by, **aggregates)
+
+    @classmethod
+    def aiter(cls, batch_size: int = 1000, **kwargs) -> AsyncIterator[Self]:
+        return cls.where(**kwargs).aiter(batch_size)
+
+    async def asave(self):
+        return await self._run_async(self.save, write=True)
+
+    async def adelete(self):
+        return await self._run_async(self.delete, write=True)
+
+    @classmethod
+    async def aupsert(
+        cls,
+        objects: Iterable[Self],
+        conflict: list[str] | None = None,
+        chunk_size: int = 500,
+    ):
+        objects = list(objects)
+        return await cls._run_async(
+            cls.upsert, objects, conflict, chunk_size, write=True
+        )
+
+    @classmethod
+    async def asave_many(cls, objects: Iterable[Self], chunk_size: int = 500):
+        objects = list(objects)
+        return await cls._run_async(
+            cls.save_many, objects, chunk_size, write=True
+        )
@@ -0,0 +1,457 @@
+from array import array
+from copy import copy
+from itertools import islice
+from typing import Any, AsyncIterator, Iterator
+
+from pydantic import BaseModel, TypeAdapter
+
+from pwdantic.datatypes import SQLCondition, SQLQuery
+from pwdantic.exceptions import PWInvalidQueryError
+from pwdantic.session import current_session
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# array typecodes and numpy dtypes of the columns columns() can read
+_column_types = {
+    "integer": ("q", "int64"),
+    "number": ("d", "float64"),
+    "boolean": ("B", "bool"),
+}
+
+
+def _take(rows: Iterator[Any], count: int) -> list[Any]:
+    return list(islice(rows, count))
+
+
+def _chunks(values: list[Any], size: int) -> Iterator[list[Any]]:
+    for start in range(0, len(values), size):
+        yield values[start : start + size]
+
+
+class PWQuery:
+    """Chainable query over a bound model, compiled to a single SELECT"""
+
+    def __init__(self, model: type[BaseModel]):
+        self.model = model
+        self._conditions: list[SQLCondition] = []
+        self._order: list[tuple[str, bool]] = []
+        self._limit: int | None = None
+        self._offset: int | None = None
+        self._after: Any = None
+        self._trusted: bool | None = None
+        self._prefetch: list[str] = []
+        # selected columns, all of them when None
+        self._columns: list[str] | None = None
+
+    def _check_field(self, name: str):
+        if name not in self.model._codec.columns:
+            raise PWInvalidQueryError()
+
+    def _check_json(self, condition: SQLCondition):
+        # json lookups need the column stored through the json codec
+        if self.model._codec.datatypes[condition.field] != "json":
+            raise PWInvalidQueryError()
+
+        if condition.lookup == "path":
+            if type(condition.value) != tuple or len(condition.value) != 2:
+                raise PWInvalidQueryError()
+            if not str(condition.value[0]).startswith("$"):
+                raise PWInvalidQueryError()
+
+    def _clone(self) -> "PWQuery":
+        clone = copy(self)
+        clone._conditions = list(self._conditions)
+        clone._order = list(self._order)
+        clone._prefetch = list(self._prefetch)
+        return clone
+
+    def where(self, **kwargs) -> "PWQuery":
+        query = self._clone()
+        for key, value in kwargs.items():
+            condition = SQLCondition.parse(key, value)
+            self._check_field(condition.field)
+            if condition.lookup in SQLCondition.json_lookups:
+                self._check_json(condition)
+            query._conditions.append(condition)
+        return query
+
+    def order_by(self, *fields: str) -> "PWQuery":
+        """Fields prefixed with "-" are sorted in descending order"""
+        query = self._clone()
+        for field in fields:
+            descending = field.startswith("-")
+            name = field.lstrip("-")
+            self._check_field(name)
+            query._order.append((name, descending))
+        return query
+
+    def limit(self, limit: int) -> "PWQuery":
+        query = self._clone()
+        query._limit = limit
+        return query
+
+    def offset(self, offset: int) -> "PWQuery":
+        query = self._clone()
+        query._offset = offset
+        return query
+
+    def after(self, last: BaseModel | tuple) -> "PWQuery":
+        """Keyset pagination, continues after the given row
+
+        Takes the last object of the previous page or a tuple with its
+        values of the ordered columns followed by its primary key.
+        """
+        query = self._clone()
+        query._after = last
+        return query
+
+    def trusted(self, trusted: bool = True) -> "PWQuery":
+        """Builds the results without validating them
+
+        Overrides the trusted setting the model was bound with, only meant
+        for rows written through the ORM.
+        """
+        query = self._clone()
+        query._trusted = trusted
+        return query
+
+    def prefetch(self, *relations: str) -> "PWQuery":
+        """Loads the given relations of all results in batched queries"""
+        query = self._clone()
+        for name in relations:
+            if name not in self.model._relations:
+                raise PWInvalidQueryError()
+            query._prefetch.append(name)
+        return query
+
+    def _check_projected(self, name: str) -> bool:
+        # relations are loaded on access anyway, they are accepted as is
+        if name in self.model._relations:
+            return False
+        self._check_field(name)
+        return True
+
+    def _selected(self) -> list[str]:
+        if self._columns is None:
+            return self.model._codec.columns
+        return self._columns
+
+    def only(self, *fields: str) -> "PWQuery":
+        """Selects only the given fields and the primary key
+
+        The other fields of the results are loaded on first access, one
+        query per object, model_dump() leaves them out until then.
+        """
+        query = self._clone()
+        wanted = [x for x in fields if self._check_projected(x)]
+        query._columns = [
+            x
+            for x in self._selected()
+            if x in wanted or x == self.model._primary
+        ]
+        return query
+
+    def defer(self, *fields: str) -> "PWQuery":
+        """Leaves the given fields out, see only()"""
+        query = self._clone()
+        deferred = [x for x in fields if self._check_projected(x)]
+        if self.model._primary in deferred:
+            raise PWInvalidQueryError()
+        query._columns = [x for x in self._selected() if x not in deferred]
+        return query
+
+    def _load_relations(self, objects: list[BaseModel]):
+        for name in self._prefetch:
+            self.model._relations[name].prefetch(objects)
+
+    def _effective_order(self) -> list[tuple[str, bool]]:
+        # keyset pagination needs a total order, the primary key breaks ties
+        primary = self.model._primary
+        if self._after is None or primary in [x[0] for x in self._order]:
+            return self._order
+        return self._order + [(primary, False)]
+
+    def _compile(self, limit: int | None = None) -> SQLQuery:
+        order = self._effective_order()
+
+        after = self._after
+        if isinstance(after, BaseModel):
+            after = tuple(getattr(after, column) for column, _ in order)
+
+        fields = (
+            self.model._codec.fields
+            if self._columns is None
+            else self.model._codec.select_fields(self._columns)
+        )
+        return SQLQuery(
+            self.model.table,
+            fields,
+            self._conditions,
+            order,
+            limit if limit is not None else self._limit,
+            self._offset,
+            after,
+        )
+
+    def all(self) -> list[BaseModel]:
+        rows = self.model.db.select_query(self._compile())
+        objects = [
+            self.model._from_row(row, self._trusted, self._columns)
+            for row in rows
+        ]
+        self._load_relations(objects)
+        return objects
+
+    def iter(self, batch_size: int = 1000) -> Iterator[BaseModel]:
+        rows = self.model.db.select_query_iter(self._compile(), batch_size)
+        if len(self._prefetch) < 1:
+            for row in rows:
+                yield self.model._from_row(row, self._trusted, self._columns)
+            return
+
+        # relations are loaded a batch at a time
+        while True:
+            batch = [
+                self.model._from_row(row, self._trusted, self._columns)
+                for row in _take(rows, batch_size)
+            ]
+            if len(batch) < 1:
+                return
+            self._load_relations(batch)
+            yield from batch
+
+    def first(self) -> BaseModel | None:
+        rows = self.model.db.select_query(self._compile(limit=1))
+        if len(rows) < 1:
+            return None
+        obj = self.model._from_row(rows[0], self._trusted, self._columns)
+        self._load_relations([obj])
+        return obj
+
+    def __iter__(self) -> Iterator[BaseModel]:
+        return self.iter()
+
+    def count(self) -> int:
+        """Number of matching rows, counted by sqlite"""
+        return self.aggregate(count="*")
+
+    def exists(self) -> bool:
+        query = self._compile(limit=1)
+        query.field = self.model._primary
+        return len(self.model.db.select_query(query)) > 0
+
+    def _check_aggregated(self, name: str):
+        # values stored through a codec cannot be compared by sqlite
+        self._check_field(name)
+        if name in self.model._codec.encoders:
+            raise PWInvalidQueryError()
+
+    def _convert(self, name: str, value: Any) -> Any:
+        converter = self.model._codec.converters.get(name, None)
+        if converter is None or value is None:
+            return value
+        return converter(value)
+
+    def aggregate(
+        self, group_by: str | list[str] | None = None, **aggregates: str
+    ) -> Any:
+        """Aggregates the matching rows in sqlite, e.g. aggregate(sum="age")
+
+        Each keyword applies one of SQLQuery.aggregates to a field, count
+        also takes "*". Returns the value, or a tuple of the values in the
+        order given. With group_by a dict of those by the value of the
+        group field is returned, keyed by tuples when grouped by several.
+        """
+        if isinstance(group_by, str):
+            group_by = [group_by]
+        group_by = list(group_by) if group_by is not None else []
+        for name in group_by:
+            self._check_aggregated(name)
+
+        if len(aggregates) < 1:
+            raise PWInvalidQueryError()
+        for func, name in aggregates.items():
+            if func not in SQLQuery.aggregates:
+                raise PWInvalidQueryError()
+            if name != "*":
+                self._check_aggregated(name)
+            elif func != "count":
+                raise PWInvalidQueryError()
+
+        rows = self.model.db.aggregate_query(
+            self._compile(), list(aggregates.items()), group_by
+        )
+
+        results = {}
+        for row in rows:
+            group = tuple(
+                self._convert(name, value)
+                for name, value in zip(group_by, row)
+            )
+            # min and max return stored values, the rest are numbers
+            values = tuple(
+                self._convert(name, value) if func in ("min", "max") else value
+                for (func, name), value in zip(
+                    aggregates.items(), row[len(group_by) :]
+                )
+            )
+            value = values[0] if len(values) == 1 else values
+
+            if len(group_by) < 1:
+                return value
+            results[group[0] if len(group) == 1 else group] = value
+
+        return results
+
+    def _forget_loaded(self):
+        # objects loaded before a bulk write may no longer match their rows
+        session = current_session()
+        if session is not None:
+            session.discard_table(self.model.table)
+
+    def update(self, **values) -> int:
+        """Updates all matching rows in one statement, returns their count"""
+        for name, value in values.items():
+            self._check_field(name)
+            if name == self.model._primary or name in self.model._codec.large:
+                raise PWInvalidQueryError()
+            field = self.model.model_fields[name]
+            values[name] = TypeAdapter(field.annotation).validate_python(value)
+
+        query = self._compile()
+        query.field = self.model._primary
+        count = self.model.db.update_query(
+            query, self.model._codec.encode_fields(values)
+        )
+        self._forget_loaded()
+        return count
+
+    def delete(self) -> int:
+        """Deletes all matching rows in one statement, returns their count"""
+        model = self.model
+        query = self._compile()
+        query.field = model._primary
+
+        relations = list(model._relations.values())
+        linking = model._linking()
+        if len(relations) + len(linking) < 1:
+            count = model.db.delete_query(query)
+            self._forget_loaded()
+            return count
+
+        # the relations of the deleted rows, and the links to them from
+        # other rows, go with them
+        with model.db.transaction():
+            keys = [x[0] for x in model.db.select_query(query)]
+            for relation in relations:
+                relation.delete_many(keys)
+            for relation in linking:
+                relation.delete_links("child", keys)
+            count = model.db.delete_query(query)
+
+        self._forget_loaded()
+        return count
+
+    def columns(
+        self, *fields: str, batch_size: int = 1000, as_numpy: bool = True
+    ) -> dict[str, Any]:
+        """Reads whole columns of the matching rows, without any objects
+
+        Returns a typed array.array per field, or a numpy array when numpy
+        is installed and as_numpy is set. Only integer, number and boolean
+        fields can be read, NULL numbers are read as nan.
+        """
+        if len(fields) < 1:
+            raise PWInvalidQueryError()
+        types = []
+        for name in fields:
+            self._check_field(name)
+            datatype = self.model._codec.datatypes[name]
+            if datatype not in _column_types:
+                raise PWInvalidQueryError()
+            types.append(datatype)
+
+        query = self._compile()
+        query.field = ", ".join(fields)
+        buffers = [array(_column_types[x][0]) for x in types]
+        nan = float("nan")
+
+        rows = self.model.db.select_query_iter(query, batch_size)
+        while True:
+            batch = _take(rows, batch_size)
+            if len(batch) < 1:
+                break
+
+            for i, (buffer, datatype) in enumerate(zip(buffers, types)):
+                if datatype == "number":
+                    values = [nan if x[i] is None else x[i] for x in batch]
+                else:
+                    values = [x[i] for x in batch]
+                try:
+                    buffer.extend(values)
+                except TypeError:
+                    # NULL integers and booleans have no array value
+                    raise PWInvalidQueryError()
+
+        if numpy is None or not as_numpy:
+            return dict(zip(fields, buffers))
+        # the arrays share the memory of the buffers
+        return {
+            name: numpy.frombuffer(buffer, dtype=_column_types[datatype][1])
+            for name, buffer, datatype in zip(fields, buffers, types)
+        }
+
+    async def aall(self) -> list[BaseModel]:
+        return await self.model._run_async(self.all)
+
+    async def afirst(self) -> BaseModel | None:
+        return await self.model._run_async(self.first)
+
+    async def acolumns(
+        self, *fields: str, batch_size: int = 1000, as_numpy: bool = True
+    ) -> dict[str, Any]:
+        return await self.model._run_async(
+            self.columns, *fields, batch_size=batch_size, as_numpy=as_numpy
+        )
+
+    async def acount(self) -> int:
+        return await self.model._run_async(self.count)
+
+    async def aexists(self) -> bool:
+        return await self.model._run_async(self.exists)
+
+    async def aaggregate(
+        self, group_by: str | list[str] | None = None, **aggregates: str
+    ) -> Any:
+        return await self.model._run_async(
+            self.aggregate, group_by, **aggregates
+        )
+
+    async def aiter(self, batch_size: int = 1000) -> AsyncIterator[BaseModel]:
+        # the generator lives on the engine thread, advanced a batch a time
+        rows = self.iter(batch_size)
+        try:
+            while True:
+                batch = await self.model._run_async(_take, rows, batch_size)
+                if len(batch) < 1:
+                    return
+                for obj in batch:
+                    yield obj
+        finally:
+            # closed on the engine thread as well, also when the consumer
+            # stopped early and this generator is finalized elsewhere
+            submit = getattr(self.model.db, "submit", None)
+            if submit is not None:
+                submit(rows.close)
+
+    def __aiter__(self) -> AsyncIterator[BaseModel]:
+        return self.aiter()
+
+    async def aupdate(self, **values) -> int:
+        return await self.model._run_async(self.update, write=True, **values)
+
+    async def adelete(self) -> int:
+        return await self.model._run_async(self.delete, write=True)
@@ -0,0 +1,188 @@
+from typing import Any, Iterable
+
+from pydantic import BaseModel
+
+from pwdantic.datatypes import SQLColumn, SQLCondition, SQLIndex, SQLQuery
+from pwdantic.query import _chunks
+
+
+def _saved_keys(obj: BaseModel) -> dict[str, list[Any]]:
+    # keys of the related objects each relation was last loaded or saved with
+    state = getattr(obj, "_pw_relations", None)
+    if state is None:
+        state = {}
+        setattr(obj, "_pw_relations", state)
+    return state
+
+
+class PWRelation:
+    """A list[Model] field stored outside of its model's row
+
+    With a foreign_key the related rows point back to their owner through
+    that field of theirs, otherwise the pairs are kept, in order, in a
+    link table. Relations are loaded on first access or in batches by
+    prefetch(), and saved together with their owner.
+    """
+
+    # relations stored in link tables, by link table
+    links: dict[str, "PWRelation"] = {}
+
+    def __init__(
+        self,
+        model: type[BaseModel],
+        name: str,
+        related: type[BaseModel],
+        foreign_key: str | None = None,
+    ):
+        self.model = model
+        self.name = name
+        self.related = related
+        self.foreign_key = foreign_key
+        self.link_table = f"_pw_link_{model.table}_{name}"
+        if foreign_key is None:
+            PWRelation.links[self.link_table] = self
+
+    @staticmethod
+    def linking(related: type[BaseModel]) -> list["PWRelation"]:
+        """Link table relations the rows of related are children in"""
+        return [x for x in PWRelation.links.values() if x.related is related]
+
+    def link_columns(
+        self, key_type: str, related_key_type: str
+    ) -> list[SQLColumn]:
+        return [
+            SQLColumn("parent", key_type, False, None),
+            SQLColumn("child", related_key_type, False, None),
+            SQLColumn("position", "integer", False, None),
+        ]
+
+    def link_indexes(self) -> list[SQLIndex]:
+        return [SQLIndex(self.link_table, ["parent", "position"])]
+
+    def _loaded_keys(self, obj: BaseModel) -> list[Any]:
+        return [x._data_bind for x in obj.__dict__[self.name]]
+
+    def _load_children(self, keys: list[Any]) -> dict[Any, list[BaseModel]]:
+        related = self.related
+        children = {}
+        # one IN (...) query per chunk of keys
+        chunk_size = self.model.db.max_variables
+
+        if self.foreign_key is not None:
+            for chunk in _chunks(keys, chunk_size):
+                query = (
+                    related.where(**{f"{self.foreign_key}__in": chunk})
+                    .order_by(related._primary)
+                )
+                for child in query.all():
+                    owner = getattr(child, self.foreign_key)
+                    children.setdefault(owner, []).append(child)
+            return children
+
+        links = []
+        for chunk in _chunks(keys, chunk_size):
+            links += self.model.db.select_query(
+                SQLQuery(
+                    self.link_table,
+                    "parent, child",
+                    [SQLCondition("parent", "in", chunk)],
+                    [("parent", False), ("position", False)],
+                )
+            )
+
+        child_keys = list(dict.fromkeys(x[1] for x in links))
+        by_key = {}
+        for chunk in _chunks(child_keys, chunk_size):
+            query = related.where(**{f"{related._primary}__in": chunk})
+            for child in query.all():
+                by_key[child._data_bind] = child
+
+        for parent, child in links:
+            if child in by_key:
+                children.setdefault(parent, []).append(by_key[child])
+        return children
+
+    def prefetch(self, objects: Iterable[BaseModel]):
+        """Loads the relation of every object, one IN query per chunk"""
+        pending = [
+            x
+            for x in objects
+            if self.name not in x.__dict__
+            and getattr(x, "_data_bind", None) is not None
+        ]
+        if len(pending) < 1:
+            return
+
+        keys = list(dict.fromkeys(x._data_bind for x in pending))
+        children = self._load_children(keys)
+
+        for obj in pending:
+            obj.__dict__[self.name] = list(children.get(obj._data_bind, []))
+            _saved_keys(obj)[self.name] = self._loaded_keys(obj)
+
+    def save(self, obj: BaseModel):
+        """Saves the loaded related objects of obj, then their links"""
+        for child in obj.__dict__[self.name]:
+            if self.foreign_key is not None:
+                setattr(child, self.foreign_key, obj._data_bind)
+            child.save()
+
+        keys = self._loaded_keys(obj)
+        if self.foreign_key is not None:
+            dropped = [
+                x for x in _saved_keys(obj).get(self.name, []) if x not in keys
+            ]
+            self._unlink(obj, dropped)
+        else:
+            if _saved_keys(obj).get(self.name, []) != keys:
+                self.delete(obj)
+                self.model.db.insert_many(
+                    self.link_table,
+                    [
+                        {"parent": obj._data_bind, "child": key, "position": i}
+                        for i, key in enumerate(keys)
+                    ],
+                )
+
+        _saved_keys(obj)[self.name] = keys
+
+    def _unlink(self, obj: BaseModel, keys: list[Any] | None = None):
+        # children removed from obj no longer point to it, the ones that
+        # were moved to another owner in the meantime are left alone
+        related = self.related
+        owned = related.where(**{self.foreign_key: obj._data_bind})
+        if keys is None:
+            owned.update(**{self.foreign_key: None})
+            return
+
+        for chunk in _chunks(keys, self.model.db.max_variables):
+            owned.where(**{f"{related._primary}__in": chunk}).update(
+                **{self.foreign_key: None}
+            )
+
+    def delete(self, obj: BaseModel):
+        if self.foreign_key is None:
+            self.model.db.delete(self.link_table, "parent", obj._data_bind)
+        else:
+            self._unlink(obj)
+
+    def delete_links(self, column: str, keys: list[Any]):
+        """Deletes the links whose parent or child is one of keys"""
+        for chunk in _chunks(keys, self.model.db.max_variables):
+            self.model.db.delete_query(
+                SQLQuery(
+                    self.link_table,
+                    conditions=[SQLCondition(column, "in", chunk)],
+                )
+            )
+
+    def delete_many(self, keys: list[Any]):
+        """Like delete(), for the owners with the given keys"""
+        if self.foreign_key is None:
+            self.delete_links("parent", keys)
+            return
+
+        for chunk in _chunks(keys, self.model.db.max_variables):
+            self.related.where(**{f"{self.foreign_key}__in": chunk}).update(
+                **{self.foreign_key: None}
+            )
@@ -1,10 +1,216 @@
-from pwdantic.exceptions import PWInvalidTypeError
-from typing import Any
+from pwdantic.exceptions import PWInvalidTypeError, PWInvalidCodecError
+import abc
+from datetime import datetime
+from typing import Any, Callable
 import pickle
-from pydantic import BaseModel
+import pydantic_core
+from pydantic import BaseModel, TypeAdapter
 from pwdantic.datatypes import SQLColumn
+from pwdantic.blob import LargeBinary
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class ColumnCodec(abc.ABC):
+    """How the values of a non-primitive field are stored
+
+    Columns using the codec get the standard type datatype, which engines
+    declare as sql_type, so the codec of a column can be read back from
+    the database. encoder() and decoder() are compiled once per field,
+    dumps() and loads() convert untyped values when a column is migrated
+    from one codec to another. None is stored as NULL.
+    """
+
+    name: str
+    datatype: str
+    sql_type: str
+
+    @abc.abstractmethod
+    def dumps(self, value: Any) -> Any:
+        pass
+
+    @abc.abstractmethod
+    def loads(self, data: Any) -> Any:
+        pass
+
+    def encoder(self, annotation: Any) -> Callable[[Any], Any]:
+        return lambda value: None if value is None else self.dumps(value)
+
+    def decoder(self, annotation: Any) -> Callable[[Any], Any]:
+        return lambda data: None if data is None else self.loads(data)
+
+
+class PickleCodec(ColumnCodec):
+    """The default, stores any python object"""
+
+    name = "pickle"
+    datatype = "bytes"
+    sql_type = "BLOB"
+
+    def dumps(self, value: Any) -> bytes:
+        return pickle.dumps(value)
+
+    def loads(self, data: bytes) -> Any:
+        return pickle.loads(data)
+
+    def encoder(self, annotation: Any) -> Callable[[Any], Any]:
+        # None is pickled as well, like it always was
+        return pickle.dumps
+
+
+class JsonCodec(ColumnCodec):
+    """JSON text, dumped and validated by pydantic"""
+
+    name = "json"
+    datatype = "json"
+    sql_type = "JSON_TEXT"
+
+    def dumps(self, value: Any) -> str:
+        return pydantic_core.to_json(value).decode("utf-8")
+
+    def loads(self, data: str | bytes) -> Any:
+        return pydantic_core.from_json(data)
+
+    def encoder(self, annotation: Any) -> Callable[[Any], Any]:
+        adapter = TypeAdapter(annotation)
+
+        def encode(value: Any) -> str | None:
+            if value is None:
+                return None
+            return adapter.dump_json(value).decode("utf-8")
+
+        return encode
+
+    def decoder(self, annotation: Any) -> Callable[[Any], Any]:
+        adapter = TypeAdapter(annotation)
+
+        def decode(data: str | None) -> Any:
+            if data is None:
+                return None
+            return adapter.validate_json(data)
+
+        return decode
+
+
+class MsgpackCodec(ColumnCodec):
+    """Compact binary, needs the optional msgpack package"""
+
+    name = "msgpack"
+    datatype = "msgpack"
+    sql_type = "MSGPACK"
+
+    def dumps(self, value: Any) -> bytes:
+        return msgpack.packb(pydantic_core.to_jsonable_python(value))
+
+    def loads(self, data: bytes) -> Any:
+        return msgpack.unpackb(data)
+
+    def encoder(self, annotation: Any) -> Callable[[Any], Any]:
+        adapter = TypeAdapter(annotation)
+
+        def encode(value: Any) -> bytes | None:
+            if value is None:
+                return None
+            return msgpack.packb(adapter.dump_python(value, mode="json"))
+
+        return encode
+
+    def decoder(self, annotation: Any) -> Callable[[Any], Any]:
+        adapter = TypeAdapter(annotation)
+
+        def decode(data: bytes | None) -> Any:
+            if data is None:
+                return None
+            return adapter.validate_python(msgpack.unpackb(data))
+
+        return decode
+
+
+class RawCodec(ColumnCodec):
+    """Stores bytes fields as they are"""
+
+    name = "raw"
+    datatype = "raw"
+    sql_type = "RAW_BLOB"
+
+    def dumps(self, value: bytes | str) -> bytes:
+        # defaults of bytes fields come from the json schema as text
+        if isinstance(value, str):
+            return value.encode("utf-8")
+        return bytes(value)
+
+    def loads(self, data: bytes) -> bytes:
+        return data
+
+
+class LargeBinaryCodec(ColumnCodec):
+    """LargeBinary fields, streamed through blob handles
+
+    Rows only carry the length of the value, the model writes and reads
+    the value itself in chunks. dumps() and loads() convert whole values
+    when a bytes field is migrated to or from a LargeBinary one.
+    """
+
+    name = "large-binary"
+    datatype = "large-binary"
+    sql_type = "LARGE_BLOB"
+
+    def dumps(self, value: Any) -> bytes:
+        if isinstance(value, LargeBinary):
+            return value.read()
+        return bytes(value)
+
+    def loads(self, data: bytes) -> bytes:
+        return data
+
+    def encoder(self, annotation: Any) -> Callable[[Any], Any]:
+        # the row holds an empty placeholder, so required columns can be
+        # written, the value follows it, see PWModel._write_blobs()
+        return lambda value: None if value is None else b""
+
+    def decoder(self, annotation: Any) -> Callable[[Any], Any]:
+        return lambda size: None if size is None else LargeBinary(size=size)
+
 
 class GeneralSQLSerializer:
+    codecs: dict[str, ColumnCodec] = {
+        x.name: x
+        for x in (
+            PickleCodec(),
+            JsonCodec(),
+            MsgpackCodec(),
+            RawCodec(),
+            LargeBinaryCodec(),
+        )
+    }
+
+    @classmethod
+    def register_codec(cls, codec: ColumnCodec):
+        cls.codecs[codec.name] = codec
+
+    @classmethod
+    def get_codec(cls, name: str) -> ColumnCodec:
+        codec = cls.codecs.get(name, None)
+        if codec is None or (type(codec) == MsgpackCodec and msgpack is None):
+            raise PWInvalidCodecError()
+        return codec
+
+    @classmethod
+    def codec_for_datatype(cls, datatype: str) -> ColumnCodec | None:
+        for codec in cls.codecs.values():
+            if codec.datatype == datatype:
+                return codec
+        return None
+
+    @classmethod
+    def codec_for_sql_type(cls, sql_type: str) -> ColumnCodec | None:
+        for codec in cls.codecs.values():
+            if codec.sql_type == sql_type:
+                return codec
+        return None
 
     def _get_column_schema(self, name: str, column: dict) -> SQLColumn:
         if "anyOf" in column.keys():
@@ -56,11 +262,23 @@ class GeneralSQLSerializer:
 
         return SQLColumn(name, str_type, nullable, default)
 
-    def _standardise_schema_col(self, col: SQLColumn) -> SQLColumn:
+    def _standardise_schema_col(
+        self, col: SQLColumn, codec: str | None = None
+    ) -> SQLColumn:
+        if codec is not None:
+            column_codec = self.get_codec(codec)
+            col.datatype = column_codec.datatype
+            if col.default is not None:
+                col.default = column_codec.dumps(col.default)
+            return col
+
         match col.datatype:
             case "integer" | "string" | "number" | "boolean" | "date-time":
                 pass
 
+            case "large-binary":
+                col.default = None
+
             case "binary":
                 col.datatype = "bytes"
                 if col.default is not None:
@@ -79,6 +297,7 @@ class GeneralSQLSerializer:
         schema: dict,
         primary: str = None,
         unique: list[str] = [],
+        codecs: dict[str, str] = {},
     ) -> list[SQLColumn]:
 
         if "properties" in schema.keys():
@@ -89,7 +308,9 @@ class GeneralSQLSerializer:
         cols = []
         for prop in props:
             raw_col = self._get_column_schema(prop, props[prop])
-            standard_col = self._standardise_schema_col(raw_col)
+            standard_col = self._standardise_schema_col(
+                raw_col, codecs.get(prop, None)
+            )
 
             if standard_col.name == primary:
                 standard_col.primary_key = True
@@ -102,39 +323,204 @@ class GeneralSQLSerializer:
 
         return cols
 
+    def compile_codec(
+        self, cls: type[BaseModel], table: str, columns: list[SQLColumn]
+    ) -> "RowCodec":
+        return RowCodec(cls, table, columns)
+
     def serialize_object(
         self, obj: BaseModel, no_bind: bool = False
     ) -> dict[str, Any]:
-        table = obj.__class__.table
-        columns = self.serialize_schema(table, obj.model_json_schema())
+        return obj.__class__._codec.encode(obj)
 
-        obj_data = {}
+    def deserialize_object(
+        self, cls: BaseModel, obj_data: tuple[Any], trusted: bool = False
+    ) -> BaseModel:
+        return cls._codec.decode(obj_data, trusted)
 
-        for col in columns:
-            if col.datatype != "bytes":
-                obj_data[col.name] = obj.__dict__.get(col.name, None)
+
+class RowCodec:
+    """Row layout of a bound model, compiled once by PWModel.bind()"""
+
+    def __init__(
+        self, cls: type[BaseModel], table: str, columns: list[SQLColumn]
+    ):
+        self.cls = cls
+        self.table = table
+        self.columns: list[str] = [x.name for x in columns]
+        self.datatypes: dict[str, str] = {x.name: x.datatype for x in columns}
+        self.primary_index: int | None = next(
+            (i for i, x in enumerate(columns) if x.primary_key), None
+        )
+
+        # columns stored through a ColumnCodec
+        self.encoders: dict[str, Callable[[Any], Any]] = {}
+        self.decoders: dict[str, Callable[[Any], Any]] = {}
+        for column in columns:
+            codec = GeneralSQLSerializer.codec_for_datatype(column.datatype)
+            if codec is None:
                 continue
+            field = cls.model_fields.get(column.name, None)
+            annotation = field.annotation if field is not None else Any
+            self.encoders[column.name] = codec.encoder(annotation)
+            self.decoders[column.name] = codec.decoder(annotation)
 
-            raw_obj = obj.__dict__.get(col.name, None)
-            obj_data[col.name] = pickle.dumps(raw_obj)
+        # the only conversions validation does on values sqlite returns
+        self.converters: dict[str, Callable[[Any], Any]] = {}
+        for column in columns:
+            if column.datatype == "date-time":
+                self.converters[column.name] = datetime.fromisoformat
+            elif column.datatype == "boolean":
+                self.converters[column.name] = bool
+        # LargeBinary columns, only their length is selected
+        self.large: list[str] = [
+            x.name for x in columns if x.datatype == LargeBinaryCodec.datatype
+        ]
+        # explicit projection, so rows match self.columns whatever
+        # order the table itself ended up in after migrations
+        self.fields: str = self.select_fields(self.columns)
+        # validators of single fields, for partially loaded objects
+        self.adapters: dict[str, TypeAdapter] = {}
+
+    def select_fields(self, columns: list[str]) -> str:
+        # length() of a blob does not read its content
+        return ", ".join(
+            f"length({x})" if x in self.large else x for x in columns
+        )
+
+    def encode(self, obj: BaseModel) -> dict[str, Any]:
+        raw = obj.__dict__
+        obj_data = {}
 
-        if no_bind:
-            return obj_data
+        for name in self.columns:
+            if name in self.encoders:
+                obj_data[name] = self.encoders[name](raw.get(name, None))
+            else:
+                obj_data[name] = raw.get(name, None)
 
         return obj_data
 
-    def deserialize_object(
-        self, cls: BaseModel, obj_data: tuple[Any]
-    ) -> BaseModel:
+    def encode_fields(self, values: dict[str, Any]) -> dict[str, Any]:
+        """Stored form of the given field values"""
+        return {
+            name: (
+                self.encoders[name](value) if name in self.encoders else value
+            )
+            for name, value in values.items()
+        }
 
-        columns = self.serialize_schema(cls.table, cls.model_json_schema())
+    def snapshot(
+        self,
+        obj: BaseModel,
+        obj_data: tuple[Any] | None = None,
+        columns: list[str] | None = None,
+    ) -> dict[str, Any]:
+        """Stored values of obj, compared against by diff()
+
+        Encoded columns are taken from obj_data, the row obj was decoded
+        from, when given. columns are the ones obj_data holds, all of
+        them by default.
+        """
+        raw = obj.__dict__
+        snapshot = {}
+        columns = self.columns if columns is None else columns
+
+        for i, name in enumerate(columns):
+            if name in self.large:
+                # the handle itself, replaced when another value is set
+                snapshot[name] = raw.get(name, None)
+            elif name not in self.encoders:
+                snapshot[name] = raw.get(name, None)
+            elif obj_data is not None:
+                snapshot[name] = obj_data[i]
+            else:
+                snapshot[name] = self.encoders[name](raw.get(name, None))
+
+        return snapshot
+
+    def diff(
+        self, obj: BaseModel, snapshot: dict[str, Any]
+    ) -> dict[str, Any]:
+        """Encoded values of the columns that changed since snapshot"""
+        raw = obj.__dict__
+        changes = {}
+
+        for name in self.columns:
+            # deferred columns that were never loaded did not change
+            if name not in raw:
+                continue
+
+            value = raw[name]
+            if name in self.large:
+                if name not in snapshot or snapshot[name] is not value:
+                    changes[name] = self.encoders[name](value)
+                continue
+
+            # encoded values may have been mutated in place,
+            # so they are compared in their stored form
+            if name in self.encoders:
+                value = self.encoders[name](value)
+
+            if name not in snapshot or snapshot[name] != value:
+                changes[name] = value
+
+        return changes
+
+    def decode(self, obj_data: tuple[Any], trusted: bool = False) -> BaseModel:
+        """Builds the object stored in obj_data
+
+        Trusted rows skip validation, they have to be ones the ORM wrote
+        from valid objects.
+        """
+        values = {}
+
+        for name, value in zip(self.columns, obj_data):
+            if name in self.decoders:
+                values[name] = self.decoders[name](value)
+            elif trusted and value is not None and name in self.converters:
+                values[name] = self.converters[name](value)
+            else:
+                values[name] = value
+
+        if trusted:
+            return self.cls.model_construct(**values)
+        return self.cls(**values)
+
+    def decode_values(
+        self, columns: list[str], obj_data: tuple[Any], trusted: bool = False
+    ) -> dict[str, Any]:
+        """Field values of the given columns, validated one by one"""
         values = {}
 
-        for i, col in enumerate(columns):
-            if col.datatype == "bytes":
-                values[col.name] = pickle.loads(obj_data[i])
+        for name, value in zip(columns, obj_data):
+            if name in self.decoders:
+                values[name] = self.decoders[name](value)
+            elif trusted:
+                if value is not None and name in self.converters:
+                    value = self.converters[name](value)
+                values[name] = value
             else:
-                values[col.name] = obj_data[i]
+                adapter = self.adapters.get(name, None)
+                if adapter is None:
+                    field = self.cls.model_fields[name]
+                    adapter = TypeAdapter(field.annotation)
+                    self.adapters[name] = adapter
+                values[name] = adapter.validate_python(value)
+
+        return values
+
+    def decode_partial(
+        self, columns: list[str], obj_data: tuple[Any], trusted: bool = False
+    ) -> BaseModel:
+        """Builds an object holding only the given columns
 
-        result = cls(**values)
-        return result
+        The other fields are left unset, the model loads them on first
+        access.
+        """
+        values = self.decode_values(columns, obj_data, trusted)
+        obj = self.cls.model_construct(_fields_set=set(values), **values)
+        # model_construct() fills in the defaults of the missing fields
+        for name in self.columns:
+            if name not in values:
+                obj.__dict__.pop(name, None)
+        return obj
@@ -0,0 +1,50 @@
+from contextvars import ContextVar, Token
+from typing import Any
+
+from pydantic import BaseModel
+
+_current_session: ContextVar["PWSession | None"] = ContextVar(
+    "pwdantic_session", default=None
+)
+
+
+def current_session() -> "PWSession | None":
+    return _current_session.get()
+
+
+class PWSession:
+    """Opt-in identity map for the duration of a with block
+
+    Inside the block, loading a row that was already loaded returns the
+    same instance without deserializing it again. save() and delete()
+    keep the map up to date.
+    """
+
+    def __init__(self):
+        self.identity_map: dict[tuple[str, Any], BaseModel] = {}
+        self._token: Token | None = None
+
+    def __enter__(self) -> "PWSession":
+        self._token = _current_session.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _current_session.reset(self._token)
+        self._token = None
+        self.clear()
+
+    def get(self, table: str, key: Any) -> BaseModel | None:
+        return self.identity_map.get((table, key), None)
+
+    def add(self, table: str, key: Any, obj: BaseModel):
+        self.identity_map[(table, key)] = obj
+
+    def discard(self, table: str, key: Any):
+        self.identity_map.pop((table, key), None)
+
+    def discard_table(self, table: str):
+        for key in [x for x in self.identity_map if x[0] == table]:
+            del self.identity_map[key]
+
+    def clear(self):
+        self.identity_map.clear()
@@ -1,57 +1,656 @@
+import hashlib
+import queue
+import re
 import sqlite3
-from typing import Any
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator
 
-from pwdantic.datatypes import PWEngine, SQLColumn
+from pwdantic.datatypes import (
+    PWEngine,
+    SQLColumn,
+    SQLCondition,
+    SQLIndex,
+    SQLQuery,
+    AddCol,
+    AddIndex,
+    DropCol,
+    DropIndex,
+    RenameCol,
+)
 from pwdantic.migrations import MigrationEngine, Migration
+from pwdantic.cache import QueryCache
+from pwdantic.serialization import GeneralSQLSerializer
 from pwdantic.exceptions import PWDestructiveMigrationError
 
 sqlite_column = tuple[int, str, str, int, Any, int]
 
+# fingerprints of the schemas the tables were last migrated to
+SCHEMA_TABLE = "_pw_schema"
+
+# runs of text outside of whitespace, quoted literals ('' escapes a quote)
+# may contain whitespace and commas
+SCHEMA_TOKEN = re.compile(r"(?:'(?:[^']|'')*'|[^\s'])+")
+
+# index entries created by _json_extract()
+JSON_EXTRACT = re.compile(r"json_extract\((\w+), '((?:[^']|'')*)'\)")
+
 
 class SQLiteEngineError(Exception):
     pass
 
 
+class SqliteProfile:
+    """Connection settings applied when an engine connects"""
+
+    def __init__(
+        self,
+        name: str,
+        pragmas: dict[str, Any] | None = None,
+        cached_statements: int = 128,
+        check_same_thread: bool = True,
+        read_only: bool = False,
+    ):
+        self.name = name
+        self.pragmas = pragmas if pragmas is not None else {}
+        self.cached_statements = cached_statements
+        self.check_same_thread = check_same_thread
+        self.read_only = read_only
+
+    def __str__(self) -> str:
+        return self.name
+
+    def connect(
+        self,
+        database: str,
+        check_same_thread: bool | None = None,
+        timeout: float = 5.0,
+    ) -> sqlite3.Connection:
+        target = database
+        uri = False
+        if self.read_only and database not in ("", ":memory:"):
+            target = f"{Path(database).absolute().as_uri()}?mode=ro"
+            uri = True
+
+        conn = sqlite3.connect(
+            target,
+            timeout=timeout,
+            cached_statements=self.cached_statements,
+            check_same_thread=(
+                check_same_thread
+                if check_same_thread is not None
+                else self.check_same_thread
+            ),
+            uri=uri,
+        )
+
+        for pragma, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+
+        return conn
+
+
+SQLITE_PROFILES: dict[str, SqliteProfile] = {
+    # sqlite3 defaults
+    "default": SqliteProfile("default"),
+    # WAL keeps readers off the writer, every commit is still fsynced
+    "durable": SqliteProfile(
+        "durable",
+        {
+            "journal_mode": "WAL",
+            "synchronous": "FULL",
+            "cache_size": -16000,
+        },
+        cached_statements=256,
+    ),
+    # a crash can lose the last commits, never corrupts the database
+    "throughput": SqliteProfile(
+        "throughput",
+        {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "cache_size": -64000,
+            "mmap_size": 268435456,
+            "temp_store": "MEMORY",
+        },
+        cached_statements=512,
+    ),
+    # for one-off imports, a crash mid-load can corrupt the database
+    "bulk-load": SqliteProfile(
+        "bulk-load",
+        {
+            "journal_mode": "MEMORY",
+            "synchronous": "OFF",
+            "cache_size": -256000,
+            "temp_store": "MEMORY",
+        },
+        cached_statements=512,
+    ),
+    "read-only-mmap": SqliteProfile(
+        "read-only-mmap",
+        {
+            "query_only": "ON",
+            "mmap_size": 1073741824,
+            "cache_size": -64000,
+            "temp_store": "MEMORY",
+        },
+        cached_statements=512,
+        read_only=True,
+    ),
+}
+
+# PRAGMAs reported by SqliteEngine.settings()
+REPORTED_PRAGMAS = [
+    "journal_mode",
+    "synchronous",
+    "cache_size",
+    "mmap_size",
+    "temp_store",
+    "query_only",
+    "foreign_keys",
+]
+
+
+def get_profile(profile: str | SqliteProfile | None) -> SqliteProfile:
+    if profile is None:
+        return SQLITE_PROFILES["default"]
+    if isinstance(profile, SqliteProfile):
+        return profile
+    if profile not in SQLITE_PROFILES:
+        raise SQLiteEngineError(f"Unknown sqlite profile {profile}")
+    return SQLITE_PROFILES[profile]
+
+
 class SqliteEngine(PWEngine):
-    def __init__(self, conn: sqlite3.Connection):
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        profile: SqliteProfile | None = None,
+        cache: QueryCache | None = None,
+    ):
         self.conn = conn
+        self.profile = profile if profile is not None else get_profile(None)
+        self.cache = cache
         self.cursor = conn.cursor()
+        self.max_variables = conn.getlimit(
+            sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER
+        )
+        self._statements: dict[tuple, str] = {}
+        self._transaction_depth = 0
+        # callbacks of each open transaction level, see on_rollback()
+        self._rollback_callbacks: list[list[Callable[[], None]]] = []
+        self._written_tables: set[str] = set()
+        self._schema_table_ready = False
+        self._schema_state: dict[str, str | None] | None = None
 
     def __del__(self):
-        self.conn.close()
+        # not set when the constructor failed
+        if hasattr(self, "conn"):
+            self.conn.close()
 
-    def _represent_bytes(self, data: bytes) -> str:
+    def _represent_bytes(self, data: bytes | str) -> str:
+        # defaults read back from the schema are already literals
+        if isinstance(data, str):
+            return data
         return f"X'{data.hex().upper()}'"
 
+    def _represent_encoded(self, data: bytes | str) -> str:
+        """Literal of a value encoded by a ColumnCodec"""
+        if isinstance(data, bytes):
+            return self._represent_bytes(data)
+        return "'" + data.replace("'", "''") + "'"
+
+    @contextmanager
+    def _reading(self) -> Iterator[sqlite3.Connection]:
+        """Connection to run reads on"""
+        yield self.conn
+
+    @contextmanager
+    def _writing(self) -> Iterator[sqlite3.Connection]:
+        """Connection to run writes on, self.conn/self.cursor inside"""
+        yield self.conn
+
+    def settings(self) -> dict[str, Any]:
+        """Settings the connection is actually running with"""
+        with self._writing() as conn:
+            settings = {
+                x: conn.execute(f"PRAGMA {x}").fetchone()[0]
+                for x in REPORTED_PRAGMAS
+            }
+
+        settings["profile"] = self.profile.name
+        settings["cached_statements"] = self.profile.cached_statements
+        settings["check_same_thread"] = self.profile.check_same_thread
+        return settings
+
+    def _commit(self):
+        # inside transaction() the commit is deferred to the outermost block
+        if self._transaction_depth == 0:
+            self.conn.commit()
+
+    def _invalidate(self, table: str):
+        """Drops the cached reads of table after a write to it"""
+        if self.cache is None:
+            return
+
+        self.cache.invalidate(table)
+        # readers may cache the old rows again until the commit
+        if self._transaction_depth > 0:
+            self._written_tables.add(table)
+
+    def _invalidate_written(self):
+        written = self._written_tables
+        self._written_tables = set()
+        for table in written:
+            self._invalidate(table)
+
+    @contextmanager
+    def transaction(self):
+        with self._writing():
+            depth = self._transaction_depth
+            savepoint = f"_pw_savepoint_{depth}"
+
+            if depth == 0:
+                if self.conn.in_transaction:
+                    self.conn.commit()
+                self.cursor.execute("BEGIN")
+            else:
+                self.cursor.execute(f"SAVEPOINT {savepoint}")
+
+            self._transaction_depth += 1
+            self._rollback_callbacks.append([])
+            try:
+                yield self
+
+            except BaseException as e:
+                self._transaction_depth = depth
+                callbacks = self._rollback_callbacks.pop()
+                if depth == 0:
+                    self.conn.rollback()
+                    self._invalidate_written()
+                else:
+                    self.cursor.execute(f"ROLLBACK TO {savepoint}")
+                    self.cursor.execute(f"RELEASE {savepoint}")
+                for callback in reversed(callbacks):
+                    callback()
+                raise e
+
+            self._transaction_depth = depth
+            callbacks = self._rollback_callbacks.pop()
+            if depth == 0:
+                self.conn.commit()
+                self._invalidate_written()
+            else:
+                self.cursor.execute(f"RELEASE {savepoint}")
+                # still undone if an enclosing transaction rolls back
+                self._rollback_callbacks[-1] += callbacks
+
+    def on_rollback(self, callback: Callable[[], None]):
+        """Calls callback if the current transaction is rolled back
+
+        Writes outside of transaction() are committed right away, they
+        register nothing.
+        """
+        with self._writing():
+            if len(self._rollback_callbacks) > 0:
+                self._rollback_callbacks[-1].append(callback)
+
+    def _statement(self, kind: str, table: str, cols: tuple[str]) -> str:
+        key = (kind, table, cols)
+        query = self._statements.get(key, None)
+        if query is not None:
+            return query
+
+        if kind == "insert" and len(cols) < 1:
+            query = f"INSERT INTO {table} DEFAULT VALUES"
+
+        elif kind == "insert":
+            col_str = ", ".join(cols)
+            val_str = ", ".join(["?"] * len(cols))
+            query = f"INSERT INTO {table} ({col_str}) VALUES({val_str})"
+
+        elif kind == "update":
+            *set_cols, primary_key = cols
+            set_string = ", ".join(f"{col} = ?" for col in set_cols)
+            query = f"UPDATE {table} SET {set_string} WHERE {primary_key} = ?"
+
+        self._statements[key] = query
+        return query
+
+    _operators = {
+        "eq": "=",
+        "ne": "!=",
+        "lt": "<",
+        "lte": "<=",
+        "gt": ">",
+        "gte": ">=",
+    }
+
+    def _json_extract(self, field: str, path: str) -> str:
+        # the path is inlined, so lookups match the expression indexes
+        path = path.replace("'", "''")
+        return f"json_extract({field}, '{path}')"
+
+    def _compile_condition(self, condition: SQLCondition) -> tuple[str, list]:
+        if condition.lookup == "contains":
+            return (
+                f"EXISTS (SELECT 1 FROM json_each({condition.field}) WHERE value = ?)",
+                [condition.value],
+            )
+
+        if condition.lookup == "path":
+            path, value = condition.value
+            expression = self._json_extract(condition.field, path)
+            if value is None:
+                return f"{expression} IS NULL", []
+            return f"{expression} = ?", [value]
+
+        if condition.lookup == "in":
+            values = list(condition.value)
+            if len(values) == 0:
+                return "0", []
+            val_str = ", ".join(["?"] * len(values))
+            return f"{condition.field} IN ({val_str})", values
+
+        if condition.value is None and condition.lookup in ("eq", "ne"):
+            negation = "NOT " if condition.lookup == "ne" else ""
+            return f"{condition.field} IS {negation}NULL", []
+
+        operator = self._operators[condition.lookup]
+        return f"{condition.field} {operator} ?", [condition.value]
+
+    def _compile_keyset(
+        self, order: list[tuple[str, bool]], after: tuple
+    ) -> tuple[str, list]:
+        # (a > ?) OR (a = ? AND b > ?) OR ...
+        alternatives = []
+        params = []
+        for i, (column, descending) in enumerate(order):
+            parts = [f"{prev} = ?" for prev, _ in order[:i]]
+            parts.append(f"{column} {'<' if descending else '>'} ?")
+            alternatives.append(f"({' AND '.join(parts)})")
+            params += list(after[: i + 1])
+
+        return f"({' OR '.join(alternatives)})", params
+
+    def _compile_where(self, query: SQLQuery) -> tuple[str, list]:
+        clauses = []
+        params = []
+
+        for condition in query.conditions:
+            clause, values = self._compile_condition(condition)
+            clauses.append(clause)
+            params += values
+
+        if query.after is not None:
+            clause, values = self._compile_keyset(query.order, query.after)
+            clauses.append(clause)
+            params += values
+
+        if len(clauses) < 1:
+            return "", params
+        return f" WHERE {' AND '.join(clauses)}", params
+
+    def _compile_select(self, query: SQLQuery) -> tuple[str, tuple]:
+        where, params = self._compile_where(query)
+        sql = f"SELECT {query.field} FROM {query.table}{where}"
+
+        if len(query.order) > 0:
+            order_str = ", ".join(
+                f"{column} {'DESC' if descending else 'ASC'}"
+                for column, descending in query.order
+            )
+            sql += f" ORDER BY {order_str}"
+
+        if query.limit is not None or query.offset is not None:
+            sql += " LIMIT ?"
+            params.append(query.limit if query.limit is not None else -1)
+
+        if query.offset is not None:
+            sql += " OFFSET ?"
+            params.append(query.offset)
+
+        return sql, tuple(params)
+
+    def _simple_query(
+        self, field: str, table: str, conditions: dict[str, Any] | None
+    ) -> SQLQuery:
+        if conditions is None:
+            return SQLQuery(table, field)
+
+        return SQLQuery(
+            table,
+            field,
+            [SQLCondition.parse(key, val) for key, val in conditions.items()],
+        )
+
     def select(
         self, field: str, table: str, conditions: dict[str, Any] | None = None
     ) -> list[Any]:
+        return self.select_query(self._simple_query(field, table, conditions))
 
-        if conditions is None:
-            query = f"SELECT {field} FROM {table}"
-            self.cursor.execute(query)
+    def select_iter(
+        self,
+        field: str,
+        table: str,
+        conditions: dict[str, Any] | None = None,
+        batch_size: int = 1000,
+    ) -> Iterator[Any]:
+        return self.select_query_iter(
+            self._simple_query(field, table, conditions), batch_size
+        )
+
+    def _cache_key(self, table: str, sql: str, params: tuple):
+        # uncommitted rows are never cached
+        if self.cache is None or self._transaction_depth > 0:
+            return None
+
+        key = (table, sql, params)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def select_query(self, query: SQLQuery) -> list[Any]:
+        sql, params = self._compile_select(query)
+        return self._fetch(query.table, sql, params)
+
+    def _fetch(self, table: str, sql: str, params: tuple) -> list[Any]:
+        key = self._cache_key(table, sql, params)
+        if key is not None:
+            rows = self.cache.get(key)
+            if rows is not None:
+                return rows
+            generation = self.cache.generation(table)
+
+        with self._reading() as conn:
+            rows = conn.execute(sql, params).fetchall()
+
+        if key is not None:
+            self.cache.put(key, rows, generation)
+        return rows
+
+    def aggregate_query(
+        self,
+        query: SQLQuery,
+        aggregates: list[tuple[str, str]],
+        group_by: list[str] = [],
+    ) -> list[tuple]:
+        """Applies the (function, column) aggregates to the matched rows
+
+        Returns a row per group, the group_by columns followed by the
+        aggregated values, a single row without group_by.
+        """
+        fields = ", ".join(
+            list(group_by)
+            + [f"{func.upper()}({column})" for func, column in aggregates]
+        )
 
+        # limited queries are aggregated over the rows they select
+        if query.limit is not None or query.offset is not None:
+            select, params = self._compile_select(query)
+            sql = f"SELECT {fields} FROM ({select})"
         else:
-            where_clause = " AND ".join(
-                f"{key} = ?" for key in conditions.keys()
-            )
-            query = f"SELECT {field} FROM {table} WHERE {where_clause}"
-            self.cursor.execute(query, tuple(conditions.values()))
+            where, params = self._compile_where(query)
+            sql = f"SELECT {fields} FROM {query.table}{where}"
+
+        if len(group_by) > 0:
+            columns = ", ".join(group_by)
+            sql += f" GROUP BY {columns} ORDER BY {columns}"
+
+        return self._fetch(query.table, sql, tuple(params))
 
-        return self.cursor.fetchall()
+    def select_query_iter(
+        self, query: SQLQuery, batch_size: int = 1000
+    ) -> Iterator[Any]:
+        sql, params = self._compile_select(query)
+
+        # a private cursor, so other calls on the engine
+        # cannot reset it while the caller is still iterating
+        with self._reading() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(sql, params)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        return
+                    yield from rows
+            finally:
+                cursor.close()
 
     def insert(self, table: str, obj_data: dict[str, Any]) -> int:
-        cols = [col for col, val in obj_data.items() if val != None]
+        cols = tuple(col for col, val in obj_data.items() if val != None)
         vals = [val for val in obj_data.values() if val != None]
 
-        col_str = ", ".join(cols)
-        val_str = ", ".join(["?"] * len(vals))
+        query = self._statement("insert", table, cols)
 
-        query = f"INSERT INTO {table} ({col_str}) VALUES({val_str})"
+        with self._writing():
+            self.cursor.execute(query, tuple(vals))
+            self._commit()
+            self._invalidate(table)
+            return self.cursor.lastrowid
 
-        self.cursor.execute(query, tuple(vals))
-        self.conn.commit()
-        return self.cursor.lastrowid
+    def insert_many(
+        self,
+        table: str,
+        rows: list[dict[str, Any]],
+        chunk_size: int = 500,
+    ) -> list[int]:
+        # rows sharing the same non-null columns share one statement
+        groups: dict[tuple[str], list[int]] = {}
+        for i, obj_data in enumerate(rows):
+            cols = tuple(col for col, val in obj_data.items() if val != None)
+            groups.setdefault(cols, []).append(i)
+
+        rowids = [None] * len(rows)
+
+        with self.transaction():
+            for cols, indexes in groups.items():
+                query = self._statement("insert", table, cols)
+
+                for start in range(0, len(indexes), chunk_size):
+                    chunk = indexes[start : start + chunk_size]
+                    self.cursor.executemany(
+                        query,
+                        [tuple(rows[i][col] for col in cols) for i in chunk],
+                    )
+
+                    # the write lock is held until commit, so the rowids
+                    # of one executemany call are consecutive
+                    last = self.cursor.execute(
+                        "SELECT last_insert_rowid()"
+                    ).fetchone()[0]
+                    first = last - len(chunk) + 1
+                    for offset, i in enumerate(chunk):
+                        rowids[i] = first + offset
+
+            self._invalidate(table)
+
+        return rowids
+
+    def upsert_many(
+        self,
+        table: str,
+        rows: list[dict[str, Any]],
+        conflict: list[str],
+        primary_key: str,
+        chunk_size: int = 500,
+    ) -> list[Any]:
+        """Inserts rows, updating the existing ones they conflict with
+
+        Returns the primary key of every row.
+        """
+        # generated keys are left out, the rest of the row is written
+        groups: dict[tuple[str], list[int]] = {}
+        for i, obj_data in enumerate(rows):
+            cols = tuple(
+                col
+                for col, val in obj_data.items()
+                if col != primary_key or val != None
+            )
+            groups.setdefault(cols, []).append(i)
+
+        keys = [row.get(primary_key, None) for row in rows]
+        by_primary = list(conflict) == [primary_key]
+
+        with self.transaction():
+            for cols, indexes in groups.items():
+                updated = [
+                    x for x in cols if x not in conflict and x != primary_key
+                ]
+                if len(updated) > 0:
+                    action = "UPDATE SET " + ", ".join(
+                        f"{x} = excluded.{x}" for x in updated
+                    )
+                else:
+                    action = "NOTHING"
+
+                query = (
+                    self._statement("insert", table, cols)
+                    + f" ON CONFLICT ({', '.join(conflict)}) DO {action}"
+                )
+                for start in range(0, len(indexes), chunk_size):
+                    chunk = indexes[start : start + chunk_size]
+                    self.cursor.executemany(
+                        query,
+                        [tuple(rows[i][col] for col in cols) for i in chunk],
+                    )
+
+                    # rows without a key cannot conflict on it, they were
+                    # all inserted, with consecutive rowids
+                    if by_primary and primary_key not in cols:
+                        last = self.cursor.execute(
+                            "SELECT last_insert_rowid()"
+                        ).fetchone()[0]
+                        for offset, i in enumerate(chunk):
+                            keys[i] = last - len(chunk) + 1 + offset
+
+            # executemany cannot return rows, the keys of rows that may
+            # have updated another one are looked up by the conflict
+            unknown = [] if by_primary else list(range(len(rows)))
+            per_query = max(1, self.max_variables // len(conflict))
+            for start in range(0, len(unknown), per_query):
+                chunk = unknown[start : start + per_query]
+                values = [tuple(rows[i][x] for x in conflict) for i in chunk]
+                placeholders = ", ".join(
+                    f"({', '.join(['?'] * len(conflict))})" for _ in chunk
+                )
+                found = self.cursor.execute(
+                    f"SELECT {', '.join(conflict)}, {primary_key} FROM {table} WHERE ({', '.join(conflict)}) IN (VALUES {placeholders})",
+                    [x for value in values for x in value],
+                ).fetchall()
+
+                by_value = {tuple(x[:-1]): x[-1] for x in found}
+                for i, value in zip(chunk, values):
+                    keys[i] = by_value.get(value, None)
+
+            self._invalidate(table)
+
+        return keys
 
     def _transfer_type_from_standard(self, str_type: str) -> str:
         types = {
@@ -63,6 +662,11 @@ class SqliteEngine(PWEngine):
             "bytes": "BLOB",
         }
 
+        if str_type not in types:
+            codec = GeneralSQLSerializer.codec_for_datatype(str_type)
+            if codec is not None:
+                return codec.sql_type
+
         return types[str_type]
 
     def _transfer_type_to_standard(self, str_type: str) -> str:
@@ -75,53 +679,129 @@ class SqliteEngine(PWEngine):
             "BLOB": "bytes",
         }
 
+        if str_type not in types:
+            codec = GeneralSQLSerializer.codec_for_sql_type(str_type)
+            if codec is not None:
+                return codec.datatype
+
         return types[str_type]
 
-    def _create_table(self, tablename: str, standard_cols: list[SQLColumn]):
-        sqlite_cols = []
-        for column in standard_cols:
-            lite_col = f"{column.name} {self._transfer_type_from_standard(column.datatype)}"
+    def _column_definition(self, column: SQLColumn) -> str:
+        lite_col = f"{column.name} {self._transfer_type_from_standard(column.datatype)}"
 
-            if column.nullable and not column.primary_key:
-                lite_col += " NULLABLE"
-            else:
-                lite_col += " NOT NULL"
+        if column.nullable and not column.primary_key:
+            lite_col += " NULLABLE"
+        else:
+            lite_col += " NOT NULL"
 
-            if column.primary_key:
-                lite_col += " PRIMARY KEY AUTOINCREMENT"
+        if column.primary_key:
+            lite_col += " PRIMARY KEY AUTOINCREMENT"
 
-            if column.unique:
-                lite_col += " UNIQUE"
+        if column.unique:
+            lite_col += " UNIQUE"
 
-            if column.default is not None:
-                if column.datatype == "string":
-                    lite_col += f" DEFAULT '{column.default.replace("'", "").replace('"', '')}'"
-                elif column.datatype != "bytes":
-                    lite_col += f" DEFAULT {column.default}"
-                else:
-                    lite_col += (
-                        f" DEFAULT {self._represent_bytes(column.default)}"
-                    )
+        if column.default is not None:
+            if column.datatype == "string":
+                lite_col += f" DEFAULT '{column.default.replace("'", "").replace('"', '')}'"
+            elif column.datatype != "bytes":
+                lite_col += f" DEFAULT {column.default}"
+            else:
+                lite_col += (
+                    f" DEFAULT {self._represent_bytes(column.default)}"
+                )
 
-            sqlite_cols.append(lite_col)
+        return lite_col
 
-        query = f"CREATE TABLE IF NOT EXISTS {tablename} ({','.join(sqlite_cols)})"
-        self.cursor.execute(query)
+    def _create_table(self, tablename: str, standard_cols: list[SQLColumn]):
+        sqlite_cols = [self._column_definition(x) for x in standard_cols]
 
-        self.conn.commit()
+        query = f"CREATE TABLE IF NOT EXISTS {tablename} ({','.join(sqlite_cols)})"
+        with self._writing():
+            self.cursor.execute(query)
+            self._commit()
+            self._invalidate(tablename)
 
     def _drop_table(self, table: str):
         query = f"DROP TABLE IF EXISTS {table}"
-        self.cursor.execute(query)
-        self.conn.commit()
+        with self._writing():
+            self.cursor.execute(query)
+            self._commit()
+            self._invalidate(table)
+            self._forget_fingerprint(table)
 
     def _rename_table(self, old_table: str, new_table: str):
         query = f"ALTER TABLE {old_table} RENAME TO {new_table}"
-        self.cursor.execute(query)
-        self.conn.commit()
+        with self._writing():
+            self.cursor.execute(query)
+            self._commit()
+            self._invalidate(old_table)
+            self._invalidate(new_table)
+
+    def _create_index(self, index: SQLIndex):
+        unique = "UNIQUE " if index.unique else ""
+        expressions = [
+            column if path is None else self._json_extract(column, path)
+            for column, path in zip(index.columns, index.paths)
+        ]
+        query = f"CREATE {unique}INDEX IF NOT EXISTS {index.name} ON {index.table} ({', '.join(expressions)})"
+        with self._writing():
+            self.cursor.execute(query)
+            self._commit()
+
+    def _drop_index(self, index_name: str):
+        query = f"DROP INDEX IF EXISTS {index_name}"
+        with self._writing():
+            self.cursor.execute(query)
+            self._commit()
+
+    def _get_indexes(self, table: str) -> list[SQLIndex]:
+        with self._reading() as conn:
+            index_list = conn.execute(f"PRAGMA index_list({table})").fetchall()
+
+            indexes = []
+            # only indexes declared through pwdantic are managed by migrations
+            for _, name, unique, _, _ in index_list:
+                if not name.startswith(SQLIndex.prefix):
+                    continue
+
+                columns, paths = self._index_columns(conn, name)
+                indexes.append(SQLIndex(table, columns, bool(unique), paths))
+
+        return indexes
+
+    def _index_columns(
+        self, conn: sqlite3.Connection, name: str
+    ) -> tuple[list[str], list[str | None]]:
+        """Columns of an index and the JSON paths indexed of them"""
+        index_info = conn.execute(f"PRAGMA index_info({name})").fetchall()
+        columns = [x[2] for x in sorted(index_info)]
+        if None not in columns:
+            return columns, [None] * len(columns)
+
+        # expressions are only kept in the statement the index was made by
+        sql = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type='index' AND name=?",
+            (name,),
+        ).fetchone()[0]
+
+        columns = []
+        paths = []
+        for part in self._split_columns(
+            sql[sql.index("(") + 1 : sql.rindex(")")]
+        ):
+            match = JSON_EXTRACT.fullmatch(part.strip())
+            if match is None:
+                columns.append(part.strip())
+                paths.append(None)
+            else:
+                columns.append(match[1])
+                paths.append(match[2].replace("''", "'"))
+
+        return columns, paths
 
     def _parse_raw_column(self, column: str) -> SQLColumn:
-        column_data: list[str] = column.split(" ")
+        # ALTER TABLE ADD COLUMN appends ", <column>" to the schema
+        column_data: list[str] = SCHEMA_TOKEN.findall(column)
         column_name = column_data.pop(0)
         column_type = self._transfer_type_to_standard(column_data.pop(0))
 
@@ -153,12 +833,36 @@ class SqliteEngine(PWEngine):
             column_name, column_type, nullable, default, primary, unique
         )
 
+    def _split_columns(self, schema: str) -> list[str]:
+        # commas inside quoted defaults or calls do not separate columns
+        columns = []
+        start = 0
+        quoted = False
+        depth = 0
+        for i, char in enumerate(schema):
+            if char == "'":
+                quoted = not quoted
+            elif quoted:
+                continue
+            elif char == "(":
+                depth += 1
+            elif char == ")":
+                depth -= 1
+            elif char == "," and depth == 0:
+                columns.append(schema[start:i])
+                start = i + 1
+
+        columns.append(schema[start:])
+        return columns
+
     def _get_SQLColumns(self, table: str) -> list[SQLColumn]:
         query = f"SELECT sql FROM sqlite_master WHERE type='table' AND name='{table}';"
-        self.cursor.execute(query)
-        current_schema = self.cursor.fetchone()[0]
-        clean_schema: str = current_schema.split("(")[1].split(")")[0]
-        raw_cols = clean_schema.split(",")
+        with self._reading() as conn:
+            current_schema = conn.execute(query).fetchone()[0]
+        clean_schema: str = current_schema[
+            current_schema.index("(") + 1 : current_schema.rindex(")")
+        ]
+        raw_cols = self._split_columns(clean_schema)
 
         standard_cols = []
         for raw_col in raw_cols:
@@ -166,96 +870,634 @@ class SqliteEngine(PWEngine):
 
         return standard_cols
 
+    def _indexed_columns(self, table: str, ignored: list[str]) -> set[str]:
+        indexed = set()
+        with self._reading() as conn:
+            for index in conn.execute(f"PRAGMA index_list({table})").fetchall():
+                if index[1] in ignored:
+                    continue
+                indexed.update(self._index_columns(conn, index[1])[0])
+
+        return indexed
+
+    def _can_alter(
+        self, migration: Migration, current_cols: list[SQLColumn]
+    ) -> bool:
+        """Checks if ALTER TABLE can apply the migration without a rebuild"""
+        current = {x.name: x for x in current_cols}
+        dropped_indexes = [
+            x.index_name for x in migration.steps if type(x) == DropIndex
+        ]
+        indexed = None
+
+        for step in migration.steps:
+            if type(step) in (AddIndex, DropIndex, RenameCol):
+                continue
+
+            if type(step) == AddCol:
+                column = step.column
+                if column.primary_key or column.unique:
+                    return False
+                if not column.nullable and column.default is None:
+                    return False
+                continue
+
+            if type(step) == DropCol:
+                column = current.get(step.column_name, None)
+                if column is None or column.primary_key or column.unique:
+                    return False
+
+                if indexed is None:
+                    indexed = self._indexed_columns(
+                        migration.table, dropped_indexes
+                    )
+                if column.name in indexed:
+                    return False
+                continue
+
+            return False
+
+        return True
+
+    def _alter_table(self, migration: Migration):
+        table = migration.table
+        migration.sort()
+
+        with self.transaction():
+            self._invalidate(table)
+            for step in migration.steps:
+                if type(step) == DropIndex:
+                    self._drop_index(step.index_name)
+
+                elif type(step) == AddCol:
+                    column = self._column_definition(step.column)
+                    self.cursor.execute(
+                        f"ALTER TABLE {table} ADD COLUMN {column}"
+                    )
+
+                elif type(step) == DropCol:
+                    self.cursor.execute(
+                        f"ALTER TABLE {table} DROP COLUMN {step.column_name}"
+                    )
+
+                elif type(step) == RenameCol:
+                    self.cursor.execute(
+                        f"ALTER TABLE {table} RENAME COLUMN {step.old_name} TO {step.new_name}"
+                    )
+
+                elif type(step) == AddIndex:
+                    self._create_index(step.index)
+
+    def _copy_rows(
+        self,
+        source: str,
+        target: str,
+        source_cols: list[str],
+        target_cols: list[str],
+        converters: dict[str, Callable[[Any], Any]],
+        chunk_size: int,
+        progress: Callable[[int], None] | None,
+    ):
+        select = f"SELECT {', '.join(source_cols)} FROM {source}"
+        insert = self._statement("insert", target, tuple(target_cols))
+        convert = [converters.get(x, None) for x in target_cols]
+
+        # own cursor, self.cursor is used for the inserts
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(select)
+            copied = 0
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    return
+
+                self.cursor.executemany(
+                    insert,
+                    [
+                        tuple(
+                            value if func is None else func(value)
+                            for func, value in zip(convert, row)
+                        )
+                        for row in rows
+                    ],
+                )
+                copied += len(rows)
+                if progress is not None:
+                    progress(copied)
+        finally:
+            cursor.close()
+
     def execute_migration(
         self,
         migration: Migration,
         force: bool = False,
+        converters: dict[str, Callable[[Any], Any]] | None = None,
+        chunk_size: int = 1000,
+        progress: Callable[[int], None] | None = None,
         _current_cols: list[SQLColumn] = None,
     ):
 
-        me = MigrationEngine()
+        with self._writing():
+            me = MigrationEngine()
 
-        if len(migration.steps) < 1:
-            return
+            if len(migration.steps) < 1:
+                return
 
-        if not force and migration.is_destructive():
-            raise PWDestructiveMigrationError()
+            if not force and migration.is_destructive():
+                raise PWDestructiveMigrationError()
 
-        if _current_cols is None:
-            _current_cols = self._get_SQLColumns(migration.table)
+            self._forget_fingerprint(migration.table)
 
-        new_cols = me.get_migrated_cols(_current_cols, migration)
+            current_indexes = self._get_indexes(migration.table)
+            new_indexes = me.get_migrated_indexes(current_indexes, migration)
 
-        temp_table = f"_temp_migrate_{migration.table}"
-        self._create_table(temp_table, new_cols)
+            if _current_cols is None:
+                _current_cols = self._get_SQLColumns(migration.table)
 
-        current = self.select("*", migration.table, None)
-        val_string = ", ".join(["?"] * len(_current_cols))
+            if self._can_alter(migration, _current_cols):
+                return self._alter_table(migration)
 
-        renamed = me.get_renamed_mapping(migration)
-        not_dropped = [x.name for x in new_cols]
-        col_str = ", ".join(
-            [
-                renamed.get(x.name, x.name)
-                for x in _current_cols
-                if renamed.get(x.name, x.name) in not_dropped
-            ]
-        )
+            new_cols = me.get_migrated_cols(_current_cols, migration)
 
-        try:
-            for row in current:
-                query = f"INSERT INTO {temp_table} ({col_str}) VALUES({val_string})"
-                self.cursor.execute(query, row)
+            renamed = me.get_renamed_mapping(migration)
+            not_dropped = [x.name for x in new_cols]
 
-            self.conn.commit()
+            source_cols = []
+            target_cols = []
+            for col in _current_cols:
+                new_name = renamed.get(col.name, col.name)
+                if new_name in not_dropped:
+                    source_cols.append(col.name)
+                    target_cols.append(new_name)
 
-        except Exception as e:
-            self._drop_table(temp_table)
-            raise e
+            converters = me.get_converters(migration) | (converters or {})
+            temp_table = f"_temp_migrate_{migration.table}"
 
-        self._drop_table(migration.table)
-        self._rename_table(temp_table, migration.table)
+            # DDL is transactional in sqlite,
+            # a failure leaves the table as it was
+            with self.transaction():
+                self._invalidate(migration.table)
+                self._create_table(temp_table, new_cols)
 
-    def _migrate_from(self, table: str, new_columns: list[SQLColumn]):
-        for col in new_columns:
-            if col.datatype == "bytes" and col.default is not None:
-                col.default = self._represent_bytes(col.default)
+                if len(converters) < 1:
+                    self.cursor.execute(
+                        f"INSERT INTO {temp_table} ({', '.join(target_cols)}) SELECT {', '.join(source_cols)} FROM {migration.table}"
+                    )
+                    if progress is not None:
+                        progress(self.cursor.rowcount)
+
+                else:
+                    self._copy_rows(
+                        migration.table,
+                        temp_table,
+                        source_cols,
+                        target_cols,
+                        converters,
+                        chunk_size,
+                        progress,
+                    )
+
+                self._drop_table(migration.table)
+                self._rename_table(temp_table, migration.table)
 
+                # the indexes were dropped together with the old table
+                for index in new_indexes:
+                    self._create_index(index)
+
+    def _migrate_from(
+        self,
+        table: str,
+        new_columns: list[SQLColumn],
+        new_indexes: list[SQLIndex] | None = None,
+    ):
         current_columns = self._get_SQLColumns(table)
+        current_indexes = (
+            self._get_indexes(table) if new_indexes is not None else None
+        )
 
         migration = MigrationEngine().generate_migration(
-            table, current_columns, new_columns
+            table,
+            current_columns,
+            new_columns,
+            current_indexes,
+            new_indexes,
         )
         if len(migration.steps) > 0:
             self.execute_migration(migration)
 
-    def migrate(self, table: str, columns: list[SQLColumn]):
-        matched_tables = self.cursor.execute(
-            f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table}';"
-        ).fetchall()
+    def _read_only(self) -> bool:
+        with self._writing() as conn:
+            query_only = conn.execute("PRAGMA query_only").fetchone()[0]
+        return self.profile.read_only or query_only == 1
 
-        if len(matched_tables) == 0:
-            return self._create_table(table, columns)
+    def _ensure_schema_table(self):
+        if self._schema_table_ready:
+            return
 
-        else:
-            return self._migrate_from(table, columns)
+        # read only connections store no fingerprints, their tables are
+        # compared by introspection
+        if not self._read_only():
+            with self._writing():
+                self.cursor.execute(
+                    f"CREATE TABLE IF NOT EXISTS {SCHEMA_TABLE} (table_name TEXT NOT NULL PRIMARY KEY, fingerprint TEXT NOT NULL)"
+                )
+                self._commit()
+        self._schema_table_ready = True
 
-    def update(self, table: str, obj_data: dict[str, Any], primary_key: str):
-        cols = [col for col, val in obj_data.items() if val != None]
-        vals = [val for val in obj_data.values() if val != None]
+    def _fingerprint(
+        self, columns: list[SQLColumn], indexes: list[SQLIndex] | None
+    ) -> str:
+        parts = [f"{x.name}:{x.signature()}" for x in columns]
+        if indexes is not None:
+            parts += [f"{x.name}:{x.signature()}" for x in indexes]
+
+        return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+    def _forget_fingerprint(self, table: str):
+        self._ensure_schema_table()
+        with self._writing():
+            self.cursor.execute(
+                f"DELETE FROM {SCHEMA_TABLE} WHERE table_name = ?", (table,)
+            )
+            self._commit()
+
+        if self._schema_state is not None:
+            self._schema_state.pop(table, None)
+
+    def _read_schema_state(self) -> dict[str, str | None]:
+        """Maps every existing table to its stored fingerprint"""
+        self._ensure_schema_table()
+        with self._reading() as conn:
+            stored = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                (SCHEMA_TABLE,),
+            ).fetchone()
+            if stored is None:
+                rows = conn.execute(
+                    "SELECT name, NULL FROM sqlite_master WHERE type = 'table'"
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    f"SELECT m.name, s.fingerprint FROM sqlite_master m LEFT JOIN {SCHEMA_TABLE} s ON s.table_name = m.name WHERE m.type = 'table'"
+                ).fetchall()
+        return dict(rows)
+
+    @contextmanager
+    def schema_snapshot(self):
+        """Reads sqlite_master once for every migrate() inside the block"""
+        self._schema_state = self._read_schema_state()
+        try:
+            yield self
+        finally:
+            self._schema_state = None
+
+    def migrate(
+        self,
+        table: str,
+        columns: list[SQLColumn],
+        indexes: list[SQLIndex] | None = None,
+    ):
+        with self._writing():
+            fingerprint = self._fingerprint(columns, indexes)
+
+            if self._schema_state is not None:
+                schema_state = self._schema_state
+            else:
+                schema_state = self._read_schema_state()
+
+            if schema_state.get(table, None) == fingerprint:
+                return
+            read_only = self._read_only()
+
+            # defaults are written and compared in the literal form they
+            # are read back from the schema in, strings are unquoted by
+            # the migration engine
+            for col in columns:
+                if col.default is None or col.datatype == "string":
+                    continue
+                codec = GeneralSQLSerializer.codec_for_datatype(col.datatype)
+                if codec is not None:
+                    col.default = self._represent_encoded(col.default)
+                else:
+                    # as _column_definition() writes them
+                    col.default = str(col.default)
+
+            with self.transaction():
+                if table not in schema_state:
+                    self._create_table(table, columns)
+                    for index in indexes or []:
+                        self._create_index(index)
+
+                else:
+                    self._migrate_from(table, columns, indexes)
+
+                if not read_only:
+                    self.cursor.execute(
+                        f"INSERT OR REPLACE INTO {SCHEMA_TABLE} (table_name, fingerprint) VALUES(?, ?)",
+                        (table, fingerprint),
+                    )
 
-        set_string = ""
-        for col in cols:
-            set_string += f"{col} = ?, "
-        set_string = set_string[:-2]
+            schema_state[table] = fingerprint
 
-        query = f"UPDATE {table} SET {set_string} WHERE {primary_key} = ?"
+    def update(self, table: str, obj_data: dict[str, Any], primary_key: str):
+        # unlike insert, None is written, it may clear a column
+        cols = tuple(col for col in obj_data.keys() if col != primary_key)
+        vals = [obj_data[col] for col in cols]
+
+        query = self._statement("update", table, cols + (primary_key,))
         vals.append(obj_data[primary_key])
 
-        self.cursor.execute(query, tuple(vals))
-        self.conn.commit()
+        with self._writing():
+            self.cursor.execute(query, tuple(vals))
+            self._commit()
+            self._invalidate(table)
 
     def delete(self, table: str, key: str, value: Any):
         query = f"DELETE FROM {table} WHERE {key} = ?"
-        self.cursor.execute(query, (value,))
-        self.conn.commit()
+        with self._writing():
+            self.cursor.execute(query, (value,))
+            self._commit()
+            self._invalidate(table)
+
+    def _compile_matching(self, query: SQLQuery) -> tuple[str, list]:
+        # sqlite is usually built without UPDATE/DELETE ... LIMIT,
+        # limited queries match the rows through their selected field
+        if query.limit is None and query.offset is None:
+            return self._compile_where(query)
+
+        select, params = self._compile_select(query)
+        return f" WHERE {query.field} IN ({select})", list(params)
+
+    def update_query(self, query: SQLQuery, obj_data: dict[str, Any]) -> int:
+        """Updates the rows matched by query, returns their count"""
+        where, params = self._compile_matching(query)
+        set_string = ", ".join(f"{col} = ?" for col in obj_data.keys())
+        sql = f"UPDATE {query.table} SET {set_string}{where}"
+
+        with self._writing():
+            self.cursor.execute(sql, tuple(obj_data.values()) + tuple(params))
+            count = self.cursor.rowcount
+            self._commit()
+            self._invalidate(query.table)
+            return count
+
+    @contextmanager
+    def open_blob(
+        self, table: str, column: str, primary_key: str, key: Any
+    ) -> Iterator[sqlite3.Blob]:
+        """Read only blob handle of the value of column in the row of key"""
+        with self._reading() as conn:
+            row = conn.execute(
+                f"SELECT rowid FROM {table} WHERE {primary_key} = ?", (key,)
+            ).fetchone()
+            if row is None:
+                raise SQLiteEngineError(f"No row of {table} has the key {key}")
+
+            with conn.blobopen(table, column, row[0], readonly=True) as blob:
+                yield blob
+
+    def write_blob(
+        self,
+        table: str,
+        column: str,
+        primary_key: str,
+        key: Any,
+        chunks: Iterable[Any],
+        size: int,
+    ):
+        """Writes size bytes, given in chunks, to column of the row of key"""
+        with self.transaction():
+            # blob handles cannot grow a value, its space is reserved first
+            self.cursor.execute(
+                f"UPDATE {table} SET {column} = zeroblob(?) WHERE {primary_key} = ?",
+                (size, key),
+            )
+            rowid = self.cursor.execute(
+                f"SELECT rowid FROM {table} WHERE {primary_key} = ?", (key,)
+            ).fetchone()[0]
+
+            with self.conn.blobopen(table, column, rowid) as blob:
+                for chunk in chunks:
+                    blob.write(chunk)
+
+            self._invalidate(table)
+
+    def delete_query(self, query: SQLQuery) -> int:
+        """Deletes the rows matched by query, returns their count"""
+        where, params = self._compile_matching(query)
+
+        with self._writing():
+            self.cursor.execute(f"DELETE FROM {query.table}{where}", params)
+            count = self.cursor.rowcount
+            self._commit()
+            self._invalidate(query.table)
+            return count
+
+
+class PooledSqliteEngine(SqliteEngine):
+    """Thread-safe engine with one serialized writer and pooled readers
+
+    Readers are checked out per call (and held for the lifetime of an
+    iteration) and run concurrently thanks to WAL, so the database has to
+    be a file. A thread inside transaction() reads through the writer to
+    see its own uncommitted changes.
+    """
+
+    def __init__(
+        self,
+        database: str,
+        size: int = 4,
+        timeout: float = 30.0,
+        profile: str | SqliteProfile | None = None,
+        cache: QueryCache | None = None,
+    ):
+        # every connection to these would open its own empty database
+        if database in ("", ":memory:"):
+            raise SQLiteEngineError(
+                "Pooled engines need a database file, not an in-memory one"
+            )
+
+        self.database = database
+        self.timeout = timeout
+        profile = get_profile(profile)
+
+        super().__init__(self._connect(profile), profile, cache)
+        if not profile.read_only:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        self._write_lock = threading.RLock()
+        self._local = threading.local()
+
+        self._readers: list[sqlite3.Connection] = []
+        self._pool: queue.Queue[sqlite3.Connection] = queue.Queue()
+        for _ in range(size):
+            reader = self._connect(profile)
+            reader.execute("PRAGMA query_only = ON")
+            self._readers.append(reader)
+            self._pool.put(reader)
+
+    def __del__(self):
+        for reader in getattr(self, "_readers", []):
+            reader.close()
+        super().__del__()
+
+    def _connect(self, profile: SqliteProfile) -> sqlite3.Connection:
+        return profile.connect(
+            self.database, check_same_thread=False, timeout=self.timeout
+        )
+
+    @contextmanager
+    def _writing(self) -> Iterator[sqlite3.Connection]:
+        local = self._local
+        with self._write_lock:
+            local.writing = getattr(local, "writing", 0) + 1
+            try:
+                yield self.conn
+            finally:
+                local.writing -= 1
+
+    @contextmanager
+    def _reading(self) -> Iterator[sqlite3.Connection]:
+        local = self._local
+
+        if getattr(local, "writing", 0) > 0:
+            yield self.conn
+            return
+
+        # nested reads of one thread share its checked out reader
+        reader = getattr(local, "reader", None)
+        if reader is None:
+            try:
+                reader = self._pool.get(timeout=self.timeout)
+            except queue.Empty:
+                raise SQLiteEngineError("No free reader connection")
+            local.reader = reader
+            local.reads = 0
+
+        local.reads += 1
+        try:
+            yield reader
+        finally:
+            local.reads -= 1
+            if local.reads == 0:
+                local.reader = None
+                self._pool.put(reader)
+
+
+class AsyncSqliteEngine(SqliteEngine):
+    """Engine running its connection on a dedicated thread
+
+    submit() queues work for that thread and returns a Future, which the
+    async model API awaits. Write jobs queued at the same time are run
+    as one transaction with a savepoint per job, so they share a single
+    commit while failing independently. Synchronous calls from other
+    threads are serialized with the worker.
+    """
+
+    def __init__(
+        self,
+        database: str,
+        max_batch: int = 256,
+        profile: str | SqliteProfile | None = None,
+        cache: QueryCache | None = None,
+    ):
+        profile = get_profile(profile)
+        super().__init__(
+            profile.connect(database, check_same_thread=False), profile, cache
+        )
+
+        self.max_batch = max_batch
+        self._lock = threading.RLock()
+        self._jobs: queue.Queue[tuple] = queue.Queue()
+
+        self._worker = threading.Thread(
+            target=self._work, name="pwdantic-sqlite", daemon=True
+        )
+        self._worker.start()
+
+    @contextmanager
+    def _writing(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            yield self.conn
+
+    @contextmanager
+    def _reading(self) -> Iterator[sqlite3.Connection]:
+        # jobs on the worker already hold the lock, row generators it
+        # advances a batch at a time must not keep it between the jobs
+        if threading.current_thread() is self._worker:
+            yield self.conn
+            return
+
+        with self._lock:
+            yield self.conn
+
+    def submit(
+        self, func: Callable, *args, write: bool = False, **kwargs
+    ) -> Future:
+        future = Future()
+        self._jobs.put((future, func, args, kwargs, write))
+        return future
+
+    def _work(self):
+        while True:
+            jobs = [self._jobs.get()]
+            while len(jobs) < self.max_batch:
+                try:
+                    jobs.append(self._jobs.get_nowait())
+                except queue.Empty:
+                    break
+
+            # jobs run in order, consecutive writes share one commit
+            start = 0
+            while start < len(jobs):
+                end = start + 1
+                while end < len(jobs) and jobs[start][4] and jobs[end][4]:
+                    end += 1
+
+                if end - start > 1:
+                    self._run_batch(jobs[start:end])
+                else:
+                    self._run(jobs[start])
+                start = end
+
+    def _run(self, job: tuple):
+        future, func, args, kwargs, _ = job
+        if not future.set_running_or_notify_cancel():
+            return
+
+        try:
+            with self._lock:
+                result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    def _run_batch(self, jobs: list[tuple]):
+        outcomes = []
+
+        try:
+            with self._lock, self.transaction():
+                for future, func, args, kwargs, _ in jobs:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+
+                    try:
+                        with self.transaction():
+                            result = func(*args, **kwargs)
+                    except BaseException as e:
+                        outcomes.append((future, e, None))
+                    else:
+                        outcomes.append((future, None, result))
+
+        except BaseException as e:
+            # the shared commit failed, none of the writes persisted
+            for future, _, _ in outcomes:
+                future.set_exception(e)
+            return
+
+        for future, error, result in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
@@ -0,0 +1,88 @@
+import asyncio
+import threading
+
+from pwdantic.pwdantic import PWModel, PWEngineFactory, PWEngine, PWSession
+
+
+class AsyncTestModel(PWModel):
+    pk: int | None = None
+    name: str
+    age: int = 0
+
+    @classmethod
+    def bind(cls, engine):
+        super().bind(
+            engine,
+            primary_key="pk",
+            unique=["name"],
+            table="async_test",
+        )
+
+
+async def async_crud(engine: PWEngine):
+    AsyncTestModel.bind(engine)
+    for obj in await AsyncTestModel.aall():
+        await obj.adelete()
+
+    objs = [AsyncTestModel(name=f"a{i}", age=i) for i in range(100)]
+    await asyncio.gather(*[x.asave() for x in objs])
+
+    # a failing write does not take the rest of its batch down
+    results = await asyncio.gather(
+        AsyncTestModel(name="a1").asave(),
+        AsyncTestModel(name="fresh").asave(),
+        return_exceptions=True,
+    )
+    assert isinstance(results[0], Exception)
+    assert results[1] is None
+
+    obj = await AsyncTestModel.aget(name="a42")
+    assert obj.age == 42
+
+    seen = [x.name async for x in AsyncTestModel.aiter(batch_size=8)]
+    assert len(seen) == 101
+
+    young = AsyncTestModel.where(age__lt=10).order_by("-age")
+    assert [x.age async for x in young][:3] == [9, 8, 7]
+    assert (await young.afirst()).age == 9
+    assert await young.acount() == 11
+    assert await young.aaggregate(max="age") == 9
+    assert await AsyncTestModel.aexists(name="fresh")
+
+    # the session of the awaiting task is used on the engine thread
+    with PWSession():
+        first = await AsyncTestModel.aget(pk=obj.pk)
+        assert await AsyncTestModel.aget(name="a42") is first
+
+    await obj.adelete()
+    assert await AsyncTestModel.aget(name="a42") is None
+    assert len(AsyncTestModel.all()) == 100
+
+
+async def async_early_break(engine: PWEngine):
+    AsyncTestModel.bind(engine)
+    async for obj in AsyncTestModel.aiter(batch_size=5):
+        break
+
+    # the engine is not left locked by the abandoned iteration
+    counts = []
+    thread = threading.Thread(
+        target=lambda: counts.append(AsyncTestModel.count()), daemon=True
+    )
+    thread.start()
+    thread.join(timeout=5)
+    assert counts == [100]
+
+
+def test_async(engine: PWEngine):
+    asyncio.run(async_crud(engine))
+    asyncio.run(async_early_break(engine))
+
+
+def main():
+    engine = PWEngineFactory.create_async_sqlite3_engine("test.db")
+    test_async(engine)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,10 @@
-from pwdantic.pwdantic import PWModel, PWEngineFactory, PWEngine
+import sqlite3
+
+from pydantic import BaseModel
+
+from pwdantic.pwdantic import PWModel, PWEngineFactory, PWEngine, PWSession
+from pwdantic.exceptions import PWInvalidCodecError, PWMissingKeysError
+from pwdantic.serialization import ColumnCodec, msgpack
 
 
 class TestModel(PWModel):
@@ -56,9 +62,369 @@ def test_crud(engine: PWEngine):
     assert len(TestModel.all()) == 0
 
 
+def test_save_many(engine: PWEngine):
+    TestModel.bind(engine)
+
+    objs = [TestModel(unq_string=f"BULK{i}") for i in range(1200)]
+    objs.append(TestModel(unq_string="BULK_INT", nullable_int=3))
+    TestModel.save_many(objs, chunk_size=500)
+
+    assert len(TestModel.all()) == 1201
+
+    for obj in objs:
+        loaded = TestModel.get(pk=obj._data_bind)
+        assert loaded.unq_string == obj.unq_string
+
+    for obj in objs:
+        obj.delete()
+
+    assert len(TestModel.all()) == 0
+
+
+def test_atomic(engine: PWEngine):
+    TestModel.bind(engine)
+
+    with TestModel.atomic():
+        TestModel(unq_string="KEPT").save()
+
+        try:
+            with TestModel.atomic():
+                TestModel(unq_string="ROLLED_BACK").save()
+                raise ValueError()
+        except ValueError:
+            pass
+
+    assert TestModel.get(unq_string="KEPT") is not None
+    assert TestModel.get(unq_string="ROLLED_BACK") is None
+
+    try:
+        with TestModel.atomic():
+            TestModel.get(unq_string="KEPT").delete()
+            raise ValueError()
+    except ValueError:
+        pass
+
+    kept = TestModel.get(unq_string="KEPT")
+    assert kept is not None
+
+    # objects written in a rolled back transaction are written again
+    # by their next save, whether inserted, updated or deleted
+    new = TestModel(unq_string="RETRIED")
+    try:
+        with TestModel.atomic():
+            new.save()
+            kept.nullable_int = 3
+            kept.save()
+            raise ValueError()
+    except ValueError:
+        pass
+    assert new.pk is None and kept.dirty_fields() == ["nullable_int"]
+    new.save()
+    kept.save()
+    assert TestModel.get(unq_string="RETRIED").pk == new.pk
+    assert TestModel.get(unq_string="KEPT").nullable_int == 3
+
+    try:
+        with TestModel.atomic():
+            new.delete()
+            raise ValueError()
+    except ValueError:
+        pass
+    new.delete()
+    assert TestModel.get(unq_string="RETRIED") is None
+
+    kept.delete()
+    assert len(TestModel.all()) == 0
+
+
+def test_iter(engine: PWEngine):
+    TestModel.bind(engine)
+
+    TestModel.save_many(
+        TestModel(unq_string=f"ITER{i}", nullable_int=i % 2)
+        for i in range(25)
+    )
+
+    seen = []
+    for obj in TestModel.iter(batch_size=4):
+        # interleaved queries must not disturb the running iteration
+        assert TestModel.get(pk=obj.pk).unq_string == obj.unq_string
+        seen.append(obj.unq_string)
+
+    assert len(seen) == 25
+    assert len(list(TestModel.iter(batch_size=10, nullable_int=1))) == 12
+
+    for obj in TestModel.all():
+        obj.delete()
+
+
+class DirtyTestModel(PWModel):
+    pk: int | None = None
+    counter: int = 0
+    label: str | None = "label"
+    payload: list[str] = []
+
+    @classmethod
+    def bind(cls, engine):
+        super().bind(engine, primary_key="pk", table="dirty_test")
+
+
+def test_dirty_tracking(engine: PWEngine):
+    DirtyTestModel.bind(engine)
+    DirtyTestModel(payload=["x"] * 1000).save()
+
+    statements = []
+    engine.conn.set_trace_callback(statements.append)
+    try:
+        obj = DirtyTestModel.get(counter=0)
+        assert obj.dirty_fields() == []
+
+        statements.clear()
+        obj.save()
+        assert statements == []
+
+        obj.counter += 1
+        obj.save()
+        updates = [x for x in statements if x.startswith("UPDATE")]
+        assert len(updates) == 1
+        assert "payload" not in updates[0]
+        assert "counter" in updates[0]
+
+        statements.clear()
+        obj.payload.append("y")
+        obj.label = None
+        assert sorted(obj.dirty_fields()) == ["label", "payload"]
+        obj.save()
+        updates = [x for x in statements if x.startswith("UPDATE")]
+        assert len(updates) == 1
+    finally:
+        engine.conn.set_trace_callback(None)
+
+    obj = DirtyTestModel.get(pk=obj.pk)
+    assert obj.counter == 1
+    assert obj.label is None
+    assert len(obj.payload) == 1001
+
+    obj.delete()
+
+
+def test_profiles(database: str):
+    engine = PWEngineFactory.create_sqlite3_engine(database, "throughput")
+    TestModel.bind(engine)
+    TestModel(unq_string="PROFILED").save()
+
+    settings = engine.settings()
+    assert settings["profile"] == "throughput"
+    assert settings["journal_mode"] == "wal"
+    assert settings["synchronous"] == 1
+    assert settings["mmap_size"] == 268435456
+
+    reader = PWEngineFactory.create_sqlite3_engine(database, "read-only-mmap")
+    assert reader.settings()["query_only"] == 1
+
+    TestModel.bind(reader)
+    obj = TestModel.get(unq_string="PROFILED")
+    assert obj is not None
+
+    try:
+        obj.delete()
+        assert False
+    except sqlite3.OperationalError:
+        pass
+
+    # tables without a stored fingerprint, or databases without any,
+    # are compared by introspection instead
+    engine._forget_fingerprint("test_basic")
+    TestModel.bind(reader)
+    engine.conn.execute("DROP TABLE _pw_schema")
+    reader = PWEngineFactory.create_sqlite3_engine(database, "read-only-mmap")
+    TestModel.bind(reader)
+    assert TestModel.get(unq_string="PROFILED") is not None
+
+    engine = PWEngineFactory.create_sqlite3_engine(database, "throughput")
+    TestModel.bind(engine)
+    obj.delete()
+
+
+def test_session(engine: PWEngine):
+    TestModel.bind(engine)
+    TestModel(unq_string="SESSION").save()
+    obj = TestModel.get(unq_string="SESSION")
+
+    # without a session every load is a fresh instance
+    assert TestModel.get(pk=obj.pk) is not TestModel.get(pk=obj.pk)
+
+    with PWSession() as session:
+        first = TestModel.get(pk=obj.pk)
+        assert TestModel.get(pk=obj.pk) is first
+        assert TestModel.get(unq_string="SESSION") is first
+        assert any(x is first for x in TestModel.all())
+        assert any(x is first for x in TestModel.iter())
+
+        # a saved instance replaces the one loaded before
+        obj.nullable_int = 3
+        obj.save()
+        assert TestModel.get(pk=obj.pk) is obj
+
+        new = TestModel(unq_string="SESSION_NEW")
+        new.save()
+        assert TestModel.get(pk=new._data_bind) is new
+
+        key = new._data_bind
+        new.delete()
+        assert TestModel.get(pk=key) is None
+
+    assert TestModel.get(pk=obj.pk) is not obj
+    obj.delete()
+
+
+def test_get_many(engine: PWEngine):
+    TestModel.bind(engine)
+    TestModel.save_many(TestModel(unq_string=f"MANY{i}") for i in range(20))
+    objs = TestModel.where(unq_string__in=[f"MANY{i}" for i in range(20)])
+    keys = [x.pk for x in objs.order_by("pk").all()]
+
+    wanted = [keys[5], -1, keys[2], keys[5], keys[19]]
+    found = TestModel.get_many(wanted)
+    assert [x.unq_string if x else None for x in found] == [
+        "MANY5",
+        None,
+        "MANY2",
+        "MANY5",
+        "MANY19",
+    ]
+
+    by_key = TestModel.get_many(wanted, as_dict=True)
+    assert list(by_key.keys()) == [keys[5], keys[2], keys[19]]
+
+    try:
+        TestModel.get_many(wanted, strict=True)
+        assert False
+    except PWMissingKeysError as e:
+        assert e.missing == [-1]
+
+    # keys are fetched in chunks the engine can bind
+    limit = engine.max_variables
+    engine.max_variables = 7
+    selects = []
+    engine.conn.set_trace_callback(
+        lambda sql: selects.append(sql) if sql.startswith("SELECT") else None
+    )
+    try:
+        assert len(TestModel.get_many(keys, strict=True)) == 20
+    finally:
+        engine.conn.set_trace_callback(None)
+        engine.max_variables = limit
+    assert len(selects) == 3
+
+    with PWSession():
+        first = TestModel.get(pk=keys[0])
+        assert TestModel.get_many(keys[:3])[0] is first
+
+    for obj in TestModel.get_many(keys):
+        obj.delete()
+
+
+class Duck(BaseModel):
+    name: str
+    age: int
+
+
+class CodecTestModel(PWModel):
+    pk: int | None = None
+    name: str
+    tags: list[str] = []
+    ducks: list[Duck] = []
+    payload: bytes = b""
+    scores: dict[str, int] | None = None
+
+    @classmethod
+    def bind(cls, engine, packed: str = "json"):
+        super().bind(
+            engine,
+            primary_key="pk",
+            unique=["name"],
+            table="codec_test",
+            codecs={
+                "tags": "json",
+                "ducks": "json",
+                "payload": "raw",
+                "scores": packed,
+            },
+        )
+
+
+def test_codecs(engine: PWEngine):
+    CodecTestModel.bind(engine)
+    for obj in CodecTestModel.all():
+        obj.delete()
+
+    CodecTestModel(
+        name="pond",
+        tags=["a", "b"],
+        ducks=[Duck(name="x", age=1)],
+        payload=b"\x00\x01",
+    ).save()
+
+    obj = CodecTestModel.get(name="pond")
+    assert obj.tags == ["a", "b"]
+    assert obj.ducks == [Duck(name="x", age=1)]
+    assert obj.payload == b"\x00\x01"
+    assert obj.scores is None
+
+    stored = engine.conn.execute(
+        "SELECT tags, ducks, payload, scores FROM codec_test"
+    ).fetchone()
+    assert stored == ('["a","b"]', '[{"name":"x","age":1}]', b"\x00\x01", None)
+
+    # in place changes of encoded fields are saved as well
+    obj.ducks[0].age = 2
+    assert obj.dirty_fields() == ["ducks"]
+    obj.save()
+    assert CodecTestModel.get(name="pond").ducks[0].age == 2
+
+    if msgpack is None:
+        try:
+            CodecTestModel.bind(engine, "msgpack")
+            assert False
+        except PWInvalidCodecError:
+            pass
+    else:
+        CodecTestModel.bind(engine, "msgpack")
+        obj = CodecTestModel.get(name="pond")
+        obj.scores = {"a": 1}
+        obj.save()
+        assert CodecTestModel.get(name="pond").scores == {"a": 1}
+
+    obj.delete()
+
+    # codecs missing dumps() or loads() cannot be constructed
+    class HalfCodec(ColumnCodec):
+        name = "half"
+        datatype = "half"
+        sql_type = "HALF"
+
+        def dumps(self, value):
+            return value
+
+    try:
+        HalfCodec()
+        assert False
+    except TypeError:
+        pass
+
+
 def main():
     engine = PWEngineFactory.create_sqlite3_engine("test.db")
     test_crud(engine)
+    test_save_many(engine)
+    test_atomic(engine)
+    test_iter(engine)
+    test_dirty_tracking(engine)
+    test_session(engine)
+    test_get_many(engine)
+    test_codecs(engine)
+    test_profiles("test.db")
 
 
 if __name__ == "__main__":
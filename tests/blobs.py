@@ -0,0 +1,172 @@
+import io
+
+from pwdantic.pwdantic import PWModel, PWEngineFactory, PWEngine, LargeBinary
+from pwdantic.exceptions import PWUnstoredBlobError
+
+
+class Attachment(PWModel):
+    pk: int | None = None
+    name: str
+    data: LargeBinary | None = None
+
+    @classmethod
+    def bind(cls, engine):
+        super().bind(
+            engine,
+            primary_key="pk",
+            unique=["name"],
+            table="attachment_test",
+        )
+
+
+class OldDocument(PWModel):
+    pk: int | None = None
+    body: bytes
+
+    @classmethod
+    def bind(cls, engine):
+        super().bind(engine, primary_key="pk", table="blob_migration_test")
+
+
+class NewDocument(PWModel):
+    pk: int | None = None
+    body: LargeBinary
+
+    @classmethod
+    def bind(cls, engine):
+        super().bind(engine, primary_key="pk", table="blob_migration_test")
+
+
+def test_streaming(engine: PWEngine):
+    Attachment.bind(engine)
+    Attachment.where().delete()
+
+    payload = bytes(range(256)) * 12289
+    report = Attachment(name="report", data=payload)
+    try:
+        report.data.open()
+        assert False
+    except PWUnstoredBlobError:
+        pass
+    report.save()
+    assert report.data.stored
+
+    Attachment.save_many(
+        [
+            Attachment(name="scan", data=io.BytesIO(b"scanned" * 1000)),
+            Attachment(name="empty"),
+        ]
+    )
+
+    # rows only carry the length of the values
+    selects = []
+    engine.conn.set_trace_callback(
+        lambda sql: selects.append(sql) if sql.startswith("SELECT") else None
+    )
+    try:
+        loaded = Attachment.get(name="report")
+    finally:
+        engine.conn.set_trace_callback(None)
+    assert "length(data)" in selects[0]
+    assert len(loaded.data) == len(payload)
+
+    assert loaded.data.read() == payload
+    assert b"".join(loaded.data.chunks(1000)) == payload
+    copy = io.BytesIO()
+    assert loaded.data.copy_to(copy) == len(payload)
+    assert copy.getvalue() == payload
+    with loaded.data.open() as blob:
+        blob.seek(256)
+        assert blob.read(3) == bytes([0, 1, 2])
+
+    assert Attachment.get(name="scan").data.read() == b"scanned" * 1000
+    assert Attachment.get(name="empty").data is None
+
+    # only replaced values are written again
+    assert loaded.dirty_fields() == []
+    loaded.data = b"replaced"
+    assert loaded.dirty_fields() == ["data"]
+    loaded.save()
+    assert Attachment.get(name="report").data.read() == b"replaced"
+
+    # a value copied from another row stays readable from both
+    empty = Attachment.get(name="empty")
+    empty.data = loaded.data
+    empty.save()
+    assert empty.data is not loaded.data
+    assert Attachment.get(name="empty").data.read() == b"replaced"
+    assert loaded.data.read() == b"replaced"
+
+    loaded.data = None
+    loaded.save()
+    assert Attachment.get(name="report").data is None
+
+    deferred = Attachment.only("name").where(name="scan").first()
+    assert "data" not in deferred.__dict__
+    assert deferred.data.read() == b"scanned" * 1000
+
+
+class RequiredDocument(PWModel):
+    pk: int | None = None
+    body: LargeBinary
+
+    @classmethod
+    def bind(cls, engine):
+        super().bind(engine, primary_key="pk", table="required_blob_test")
+
+
+def test_required(engine: PWEngine):
+    RequiredDocument.bind(engine)
+    RequiredDocument.where().delete()
+
+    document = RequiredDocument(body=b"hello")
+    document.save()
+    RequiredDocument.save_many([RequiredDocument(body=b"many")])
+    RequiredDocument.upsert([RequiredDocument(body=b"upserted")])
+    assert sorted(x.body.read() for x in RequiredDocument.all()) == [
+        b"hello",
+        b"many",
+        b"upserted",
+    ]
+
+    document.body = b"changed"
+    document.save()
+    assert RequiredDocument.get(pk=document.pk).body.read() == b"changed"
+
+    upserted = RequiredDocument(pk=document.pk, body=b"again")
+    RequiredDocument.upsert([upserted])
+    assert RequiredDocument.get(pk=document.pk).body.read() == b"again"
+
+    # a rolled back value is still written by the next save
+    retried = RequiredDocument(body=io.BytesIO(b"retried"))
+    try:
+        with RequiredDocument.atomic():
+            retried.save()
+            raise ValueError()
+    except ValueError:
+        pass
+    assert not retried.body.stored
+    retried.save()
+    assert RequiredDocument.get(pk=retried.pk).body.read() == b"retried"
+
+
+def test_migration(engine: PWEngine):
+    OldDocument.bind(engine)
+    OldDocument.where().delete()
+    OldDocument(body=b"pickled before").save()
+
+    # pickled bytes fields are unpickled into the blob column
+    NewDocument.bind(engine)
+    document = NewDocument.all()[0]
+    assert document.body.read() == b"pickled before"
+
+
+def main():
+    engine = PWEngineFactory.create_sqlite3_engine("test.db")
+    test_streaming(engine)
+    test_required(engine)
+    test_migration(engine)
+
+
+if __name__ == "__main__":
+    main()
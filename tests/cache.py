@@ -0,0 +1,118 @@
+from pwdantic.pwdantic import PWModel, PWEngineFactory, PWEngine, QueryCache
+
+
+class CacheTestModel(PWModel):
+    pk: int | None = None
+    code: str
+    label: str
+
+    @classmethod
+    def bind(cls, engine):
+        super().bind(
+            engine,
+            primary_key="pk",
+            unique=["code"],
+            table="cache_test",
+        )
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_read_through(engine: PWEngine):
+    cache = engine.cache
+    CacheTestModel.bind(engine)
+    for obj in CacheTestModel.all():
+        obj.delete()
+    cache.clear()
+
+    CacheTestModel.save_many(
+        [CacheTestModel(code=f"c{i}", label=f"l{i}") for i in range(5)]
+    )
+
+    hits = cache.hits
+    assert CacheTestModel.get(code="c1").label == "l1"
+    assert CacheTestModel.get(code="c1").label == "l1"
+    assert cache.hits == hits + 1
+
+    # every write path drops the cached reads of the table
+    obj = CacheTestModel.get(code="c1")
+    obj.label = "changed"
+    obj.save()
+    assert CacheTestModel.get(code="c1").label == "changed"
+
+    CacheTestModel(code="c5", label="l5").save()
+    assert len(CacheTestModel.all()) == 6
+    assert len(CacheTestModel.all()) == 6
+
+    CacheTestModel.get(code="c5").delete()
+    assert CacheTestModel.get(code="c5") is None
+    assert len(CacheTestModel.all()) == 5
+
+    # reads inside a transaction are not cached, a rollback
+    # leaves nothing stale behind
+    try:
+        with CacheTestModel.atomic():
+            CacheTestModel(code="c6", label="l6").save()
+            assert CacheTestModel.get(code="c6") is not None
+            raise ValueError()
+    except ValueError:
+        pass
+    assert CacheTestModel.get(code="c6") is None
+    assert cache.stats()["invalidations"] > 0
+
+
+def test_eviction(engine: PWEngine):
+    cache = engine.cache
+    clock = cache.clock
+    CacheTestModel.bind(engine)
+    cache.clear()
+
+    for i in range(5):
+        CacheTestModel.get(code=f"c{i}")
+    assert cache.stats()["size"] == cache.max_size
+    assert cache.evictions >= 5 - cache.max_size
+
+    # the most recently used entry is still there, the oldest is not
+    hits = cache.hits
+    CacheTestModel.get(code="c4")
+    assert cache.hits == hits + 1
+    misses = cache.misses
+    CacheTestModel.get(code="c0")
+    assert cache.misses == misses + 1
+
+    clock.now += cache.ttl + 1
+    CacheTestModel.get(code="c4")
+    assert cache.expirations > 0
+
+
+def test_schema_changes(engine: PWEngine):
+    cache = engine.cache
+    CacheTestModel.bind(engine)
+    CacheTestModel(code="c7", label="l7").save()
+    assert len(CacheTestModel.all()) > 0
+    assert len(CacheTestModel.all()) > 0
+
+    # the cached rows of a dropped table are gone with it
+    invalidations = cache.invalidations
+    engine._drop_table("cache_test")
+    CacheTestModel.bind(engine)
+    assert CacheTestModel.all() == []
+    assert cache.invalidations > invalidations
+
+
+def main():
+    cache = QueryCache(max_size=3, ttl=10.0, clock=Clock())
+    engine = PWEngineFactory.create_sqlite3_engine("test.db", cache=cache)
+    test_read_through(engine)
+    test_eviction(engine)
+    test_schema_changes(engine)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,8 @@
+import pickle
+
 from pwdantic.pwdantic import PWModel, PWEngineFactory, PWEngine
 from pwdantic.datatypes import *
+from pwdantic.migrations import MigrationEngine
 
 
 class MigrationTestModelOld(PWModel):
@@ -35,6 +38,268 @@ class MigrationTestModelNew(PWModel):
         )
 
 
+class IndexTestModel(PWModel):
+    pk: int | None = None
+    name: str
+    color: str = "Brown"
+    age: int | None = None
+
+    @classmethod
+    def bind(cls, engine, indexes):
+        super().bind(
+            engine,
+            primary_key="pk",
+            table="index_test",
+            indexes=indexes,
+        )
+
+
+def index_migration(engine: PWEngine):
+    engine._drop_table("index_test")
+
+    IndexTestModel.bind(engine, [("color",), ("age", "name")])
+    IndexTestModel(name="a", age=3).save()
+
+    indexes = {x.name: x.columns for x in engine._get_indexes("index_test")}
+    assert indexes == {
+        "_pw_idx_index_test_color": ["color"],
+        "_pw_idx_index_test_age_name": ["age", "name"],
+    }
+
+    plan = engine.cursor.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM index_test WHERE color = ?",
+        ("Brown",),
+    ).fetchall()
+    assert "_pw_idx_index_test_color" in str(plan)
+
+    IndexTestModel.bind(engine, [("name",), ("age", "name")])
+
+    indexes = [x.name for x in engine._get_indexes("index_test")]
+    assert sorted(indexes) == [
+        "_pw_idx_index_test_age_name",
+        "_pw_idx_index_test_name",
+    ]
+    assert IndexTestModel.get(name="a").age == 3
+
+
+class AlterTestModelOld(PWModel):
+    pk: int | None = None
+    name: str
+    legacy: int | None = None
+    color: str | None = None
+    counter: int = 0
+    ratio: float = 0.5
+    swims: bool = False
+
+    @classmethod
+    def bind(cls, engine):
+        super().bind(
+            engine,
+            primary_key="pk",
+            table="alter_test",
+            indexes=[("color",)],
+        )
+
+
+class AlterTestModelNew(PWModel):
+    pk: int | None = None
+    name: str
+    legacy: int | None = None
+    colour: str | None = None
+    counter: int = 0
+    ratio: float = 0.5
+    swims: bool = False
+    age: int = 1
+    nickname: str | None = None
+
+    @classmethod
+    def bind(cls, engine):
+        super().bind(
+            engine,
+            primary_key="pk",
+            table="alter_test",
+            indexes=[("colour",)],
+        )
+
+
+def alter_migration(engine: PWEngine):
+    engine._drop_table("alter_test")
+
+    AlterTestModelOld.bind(engine)
+    AlterTestModelOld(name="a", legacy=1, color="red").save()
+
+    old_cols = engine._get_SQLColumns("alter_test")
+    # unchanged non-string defaults do not force a rebuild either
+    statements = []
+    engine.conn.set_trace_callback(statements.append)
+    try:
+        AlterTestModelNew.bind(engine)
+    finally:
+        engine.conn.set_trace_callback(None)
+    assert not any("_temp_migrate" in x for x in statements)
+
+    migration = MigrationEngine().generate_migration(
+        "alter_test",
+        old_cols,
+        engine._get_SQLColumns("alter_test"),
+    )
+    assert engine._can_alter(migration, old_cols)
+
+    obj = AlterTestModelNew.get(name="a")
+    assert obj.pk == 1
+    assert obj.colour == "red"
+    assert obj.age == 1
+    assert obj.nickname is None
+    assert [x.name for x in engine._get_indexes("alter_test")] == [
+        "_pw_idx_alter_test_colour"
+    ]
+
+    drop = Migration("alter_test", [DropCol("legacy")])
+    assert engine._can_alter(drop, engine._get_SQLColumns("alter_test"))
+    engine.execute_migration(drop, True)
+
+    assert "legacy" not in [
+        x.name for x in engine._get_SQLColumns("alter_test")
+    ]
+
+
+class RebuildTestModel(PWModel):
+    pk: int | None = None
+    name: str
+    score: int
+
+    @classmethod
+    def bind(cls, engine):
+        super().bind(
+            engine,
+            primary_key="pk",
+            unique=["name"],
+            table="rebuild_test",
+        )
+
+
+def rebuild_migration(engine: PWEngine):
+    engine._drop_table("rebuild_test")
+
+    RebuildTestModel.bind(engine)
+    RebuildTestModel.save_many(
+        RebuildTestModel(name=f"r{i}", score=i) for i in range(50)
+    )
+
+    copied = []
+    set_based = Migration(
+        "rebuild_test",
+        [RemoveConstraint("name", SQLConstraint.unique.value)],
+    )
+    engine.execute_migration(set_based, progress=copied.append)
+    assert copied == [50]
+    assert len(RebuildTestModel.where(score__lt=10).all()) == 10
+    assert not [
+        x for x in engine._get_SQLColumns("rebuild_test") if x.name == "name"
+    ][0].unique
+
+    copied = []
+    retype = Migration(
+        "rebuild_test", [RetypeCol("score", "integer", "bytes")]
+    )
+    engine.execute_migration(
+        retype, True, chunk_size=20, progress=copied.append
+    )
+    assert copied == [20, 40, 50]
+
+    scores = engine.select("score", "rebuild_test", {"name": "r7"})
+    assert pickle.loads(scores[0][0]) == 7
+
+
+class CodecTestModelOld(PWModel):
+    pk: int | None = None
+    name: str
+    tags: list[str] = []
+
+    @classmethod
+    def bind(cls, engine):
+        super().bind(
+            engine,
+            primary_key="pk",
+            unique=["name"],
+            table="codec_migration_test",
+        )
+
+
+class CodecTestModelNew(PWModel):
+    pk: int | None = None
+    name: str
+    tags: list[str] = ["a, 'b'"]
+
+    @classmethod
+    def bind(cls, engine):
+        super().bind(
+            engine,
+            primary_key="pk",
+            unique=["name"],
+            table="codec_migration_test",
+            codecs={"tags": "json"},
+        )
+
+
+def codec_migration(engine: PWEngine):
+    engine._drop_table("codec_migration_test")
+
+    CodecTestModelOld.bind(engine)
+    CodecTestModelOld.save_many(
+        CodecTestModelOld(name=f"c{i}", tags=[f"t{i}", "x"]) for i in range(10)
+    )
+
+    # the pickled values are decoded and stored as json
+    CodecTestModelNew.bind(engine)
+    obj = CodecTestModelNew.get(name="c3")
+    assert obj.tags == ["t3", "x"]
+    stored = engine.conn.execute(
+        "SELECT typeof(tags), tags FROM codec_migration_test WHERE name = 'c3'"
+    ).fetchone()
+    assert stored == ("text", '["t3","x"]')
+
+    # a default with quotes and commas is read back unchanged
+    columns = engine._get_SQLColumns("codec_migration_test")
+    tags = [x for x in columns if x.name == "tags"][0]
+    assert tags.datatype == "json"
+    assert tags.default == "'[\"a, ''b''\"]'"
+
+    engine._forget_fingerprint("codec_migration_test")
+    migrations = []
+    engine.execute_migration = lambda *args, **kwargs: migrations.append(args)
+    try:
+        CodecTestModelNew.bind(engine)
+    finally:
+        del engine.execute_migration
+    assert migrations == []
+
+    CodecTestModelOld.bind(engine)
+    assert CodecTestModelOld.get(name="c3").tags == ["t3", "x"]
+
+
+def fingerprint_cache(engine: PWEngine):
+    engine._drop_table("alter_test")
+    engine._drop_table("rebuild_test")
+
+    PWModel.bind_all(engine, [AlterTestModelOld, RebuildTestModel])
+    AlterTestModelOld(name="a").save()
+
+    def no_introspection(table):
+        raise AssertionError("unchanged schema was introspected")
+
+    engine._get_SQLColumns = no_introspection
+    try:
+        PWModel.bind_all(engine, [AlterTestModelOld, RebuildTestModel])
+        AlterTestModelOld.bind(engine)
+    finally:
+        del engine._get_SQLColumns
+
+    # a changed model is still migrated
+    AlterTestModelNew.bind(engine)
+    assert AlterTestModelNew.get(name="a").age == 1
+
+
 def automatic_migration(engine: PWEngine):
     MigrationTestModelOld.bind(engine)
 
@@ -77,6 +342,11 @@ def main():
     engine._drop_table("migration_test")
     #manual_migration(engine)
     automatic_migration(engine)
+    index_migration(engine)
+    alter_migration(engine)
+    rebuild_migration(engine)
+    codec_migration(engine)
+    fingerprint_cache(engine)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,75 @@
+import threading
+
+from pwdantic.pwdantic import PWModel, PWEngineFactory, PWEngine, QueryCache
+from pwdantic.sqlite import SQLiteEngineError
+
+
+class PoolTestModel(PWModel):
+    pk: int | None = None
+    name: str
+    worker: int
+
+    @classmethod
+    def bind(cls, engine):
+        super().bind(
+            engine,
+            primary_key="pk",
+            unique=["name"],
+            table="pool_test",
+            indexes=[("worker",)],
+        )
+
+
+def test_threads(engine: PWEngine):
+    PoolTestModel.bind(engine)
+    for obj in PoolTestModel.all():
+        obj.delete()
+
+    errors = []
+
+    def work(worker: int):
+        try:
+            for i in range(50):
+                PoolTestModel(name=f"{worker}-{i}", worker=worker).save()
+                assert PoolTestModel.get(name=f"{worker}-{i}") is not None
+
+            with PoolTestModel.atomic():
+                for obj in PoolTestModel.iter(batch_size=7, worker=worker):
+                    if obj.pk % 2 == 0:
+                        obj.delete()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(x,)) for x in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(PoolTestModel.all()) == 200
+    assert all(x.pk % 2 == 1 for x in PoolTestModel.iter())
+
+
+def test_memory_refused():
+    for database in ("", ":memory:"):
+        try:
+            PWEngineFactory.create_pooled_sqlite3_engine(database)
+            assert False
+        except SQLiteEngineError:
+            pass
+
+
+def main():
+    test_memory_refused()
+    engine = PWEngineFactory.create_pooled_sqlite3_engine("test.db", size=4)
+    test_threads(engine)
+
+    engine = PWEngineFactory.create_pooled_sqlite3_engine(
+        "test.db", size=4, cache=QueryCache()
+    )
+    test_threads(engine)
+
+
+if __name__ == "__main__":
+    main()
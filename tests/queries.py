@@ -0,0 +1,486 @@
+import math
+from datetime import datetime
+
+from pydantic import BaseModel
+
+from pwdantic.pwdantic import PWModel, PWEngineFactory, PWEngine
+from pwdantic.exceptions import PWInvalidQueryError
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class QueryTestModel(PWModel):
+    pk: int | None = None
+    name: str
+    age: int
+    color: str | None = None
+
+    @classmethod
+    def bind(cls, engine):
+        super().bind(
+            engine,
+            primary_key="pk",
+            unique=["name"],
+            table="query_test",
+        )
+
+
+def fill(engine: PWEngine):
+    QueryTestModel.bind(engine)
+    for obj in QueryTestModel.all():
+        obj.delete()
+
+    QueryTestModel.save_many(
+        QueryTestModel(
+            name=f"duck{i:02}",
+            age=i % 10,
+            color="brown" if i % 3 == 0 else None,
+        )
+        for i in range(30)
+    )
+
+
+def test_filters(engine: PWEngine):
+    fill(engine)
+
+    assert len(QueryTestModel.where(age__gt=7).all()) == 6
+    assert len(QueryTestModel.where(age__gte=7, age__lt=9).all()) == 6
+    assert len(QueryTestModel.where(age__in=[1, 2]).all()) == 6
+    assert len(QueryTestModel.where(age__in=[]).all()) == 0
+    assert len(QueryTestModel.where(color=None).all()) == 20
+    assert len(QueryTestModel.where(color__ne=None).all()) == 10
+
+    chained = QueryTestModel.where(age__gt=7).where(color="brown")
+    assert [x.name for x in chained.order_by("name")] == [
+        "duck09",
+        "duck18",
+    ]
+
+    assert QueryTestModel.get(age=3, color="brown").name == "duck03"
+    assert QueryTestModel.get(age=100) is None
+
+    try:
+        QueryTestModel.where(wingspan__gt=3)
+        assert False
+    except PWInvalidQueryError:
+        pass
+
+
+def test_paging(engine: PWEngine):
+    fill(engine)
+
+    ordered = QueryTestModel.where().order_by("-age", "name")
+    page = ordered.limit(5).all()
+    assert [x.name for x in page] == [
+        "duck09",
+        "duck19",
+        "duck29",
+        "duck08",
+        "duck18",
+    ]
+
+    offset_page = ordered.limit(5).offset(5).all()
+    keyset_page = ordered.after(page[-1]).limit(5).all()
+    assert [x.name for x in offset_page] == [x.name for x in keyset_page]
+
+    seen = []
+    query = QueryTestModel.where(age__lt=5).order_by("age").limit(4)
+    page = query.all()
+    while len(page) > 0:
+        seen += [x.pk for x in page]
+        page = query.after(page[-1]).all()
+
+    assert len(seen) == 15
+    assert len(set(seen)) == 15
+
+
+class Duckling(BaseModel):
+    name: str
+
+
+class TrustedTestModel(PWModel):
+    pk: int | None = None
+    name: str
+    hatched: datetime
+    swims: bool
+    children: list[Duckling] = []
+
+    @classmethod
+    def bind(cls, engine):
+        super().bind(
+            engine,
+            primary_key="pk",
+            unique=["name"],
+            table="trusted_test",
+            trusted=True,
+        )
+
+
+def test_trusted(engine: PWEngine):
+    TrustedTestModel.bind(engine)
+    for obj in TrustedTestModel.all():
+        obj.delete()
+
+    hatched = datetime(2024, 5, 1, 12, 30, 15, 250)
+    TrustedTestModel(
+        name="mother",
+        hatched=hatched,
+        swims=True,
+        children=[Duckling(name="a"), Duckling(name="b")],
+    ).save()
+
+    trusted = TrustedTestModel.get(name="mother")
+    validated = TrustedTestModel.where(name="mother").trusted(False).first()
+
+    for obj in (trusted, validated):
+        assert obj.hatched == hatched
+        assert obj.swims is True
+        assert [x.name for x in obj.children] == ["a", "b"]
+    assert trusted == validated
+
+    # still bound, so it can be updated and deleted
+    trusted.swims = False
+    trusted.save()
+    assert TrustedTestModel.get(name="mother").swims is False
+    trusted.delete()
+
+
+class JsonTestModel(PWModel):
+    pk: int | None = None
+    name: str
+    tags: list[str] = []
+    ducklings: list[Duckling] = []
+    scores: dict[str, int] = {}
+
+    @classmethod
+    def bind(cls, engine):
+        super().bind(
+            engine,
+            primary_key="pk",
+            unique=["name"],
+            table="json_test",
+            codecs={"tags": "json", "ducklings": "json", "scores": "json"},
+            json_indexes=[("scores", "$.rank"), ("ducklings", "$[0].name")],
+        )
+
+
+def test_json(engine: PWEngine):
+    JsonTestModel.bind(engine)
+    for obj in JsonTestModel.all():
+        obj.delete()
+
+    JsonTestModel.save_many(
+        JsonTestModel(
+            name=f"pond{i}",
+            tags=["wet", "big" if i % 2 == 0 else "small"],
+            ducklings=[Duckling(name=f"d{i}")],
+            scores={"rank": i % 5, "it's": i},
+        )
+        for i in range(20)
+    )
+
+    assert len(JsonTestModel.where(tags__contains="big").all()) == 10
+    assert len(JsonTestModel.where(tags__contains="dry").all()) == 0
+
+    ranked = JsonTestModel.where(scores__path=("$.rank", 3)).all()
+    assert sorted(x.name for x in ranked) == [
+        "pond13",
+        "pond18",
+        "pond3",
+        "pond8",
+    ]
+    first = JsonTestModel.get(ducklings__path=("$[0].name", "d7"))
+    assert first.name == "pond7"
+    assert JsonTestModel.get(scores__path=('$."it\'s"', 4)).name == "pond4"
+
+    # path lookups are answered from the expression index
+    sql, params = engine._compile_select(
+        JsonTestModel.where(scores__path=("$.rank", 3))._compile()
+    )
+    plan = engine.conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    assert "_pw_idx_json_test_scores_rank" in str(plan)
+
+    # the indexes are read back as they were declared
+    engine._forget_fingerprint("json_test")
+    migrations = []
+    engine.execute_migration = lambda *args, **kwargs: migrations.append(args)
+    try:
+        JsonTestModel.bind(engine)
+    finally:
+        del engine.execute_migration
+    assert migrations == []
+
+    for lookup in [
+        {"name__contains": "pond"},
+        {"scores__path": "$.rank"},
+        {"scores__path": ("rank", 3)},
+    ]:
+        try:
+            JsonTestModel.where(**lookup)
+            assert False
+        except PWInvalidQueryError:
+            pass
+
+
+class ProjectionTestModel(PWModel):
+    pk: int | None = None
+    name: str
+    hatched: datetime
+    ducklings: list[Duckling] = []
+    photo: bytes = b""
+
+    @classmethod
+    def bind(cls, engine):
+        super().bind(
+            engine,
+            primary_key="pk",
+            unique=["name"],
+            table="projection_test",
+        )
+
+
+def test_projection(engine: PWEngine):
+    ProjectionTestModel.bind(engine)
+    for obj in ProjectionTestModel.all():
+        obj.delete()
+
+    hatched = datetime(2024, 5, 1, 12, 30)
+    ProjectionTestModel.save_many(
+        ProjectionTestModel(
+            name=f"mother{i}",
+            hatched=hatched,
+            ducklings=[Duckling(name=f"d{i}")],
+            photo=bytes(1000),
+        )
+        for i in range(3)
+    )
+
+    selects = []
+    engine.conn.set_trace_callback(
+        lambda sql: selects.append(sql) if sql.startswith("SELECT") else None
+    )
+    try:
+        ducks = ProjectionTestModel.only("name").order_by("name").all()
+        assert [x.name for x in ducks] == ["mother0", "mother1", "mother2"]
+        assert len(selects) == 1
+        assert "photo" not in selects[0] and "ducklings" not in selects[0]
+        assert "photo" not in ducks[0].__dict__
+
+        # deferred columns are loaded together on first access
+        assert ducks[0].ducklings == [Duckling(name="d0")]
+        assert ducks[0].photo == bytes(1000)
+        assert ducks[0].hatched == hatched
+        assert len(selects) == 2
+    finally:
+        engine.conn.set_trace_callback(None)
+
+    # only the loaded columns that changed are written
+    query = ProjectionTestModel.defer("photo", "ducklings").order_by("name")
+    duck = query.first()
+    assert "hatched" in duck.__dict__ and "photo" not in duck.__dict__
+    assert duck.dirty_fields() == []
+    duck.name = "renamed"
+    assert duck.dirty_fields() == ["name"]
+    duck.save()
+
+    saved = ProjectionTestModel.get(name="renamed")
+    assert saved.photo == bytes(1000)
+    assert saved.ducklings == [Duckling(name="d0")]
+
+    for fields in (("wingspan",), ("pk",)):
+        try:
+            ProjectionTestModel.defer(*fields)
+            assert False
+        except PWInvalidQueryError:
+            pass
+
+
+def test_aggregates(engine: PWEngine):
+    fill(engine)
+
+    assert QueryTestModel.count() == 30
+    assert QueryTestModel.count(color="brown") == 10
+    assert QueryTestModel.where(age__gt=7).count() == 6
+    assert QueryTestModel.where().order_by("name").limit(5).count() == 5
+    assert QueryTestModel.exists(name="duck03")
+    assert not QueryTestModel.exists(age=100)
+
+    assert QueryTestModel.aggregate(sum="age") == 135
+    assert QueryTestModel.aggregate(min="age", max="age") == (0, 9)
+    assert QueryTestModel.where(age=100).aggregate(max="age") is None
+    assert QueryTestModel.aggregate(count="*", group_by="color") == {
+        None: 20,
+        "brown": 10,
+    }
+    assert QueryTestModel.aggregate(sum="age", group_by="color") == {
+        None: 90,
+        "brown": 45,
+    }
+
+    by_age = QueryTestModel.where(color="brown").aggregate(
+        count="*", group_by=["color", "age"]
+    )
+    assert len(by_age) == 10
+    assert by_age[("brown", 3)] == 1
+
+    # min and max come back as the field type
+    assert ProjectionTestModel.aggregate(max="hatched") == datetime(
+        2024, 5, 1, 12, 30
+    )
+
+    for aggregates in (
+        {},
+        {"median": "age"},
+        {"sum": "*"},
+        {"sum": "wingspan"},
+    ):
+        try:
+            QueryTestModel.aggregate(**aggregates)
+            assert False
+        except PWInvalidQueryError:
+            pass
+
+    try:
+        ProjectionTestModel.aggregate(max="photo")
+        assert False
+    except PWInvalidQueryError:
+        pass
+
+
+class ColumnTestModel(PWModel):
+    pk: int | None = None
+    age: int
+    score: float | None = None
+    swims: bool = False
+    nickname: str | None = None
+
+    @classmethod
+    def bind(cls, engine):
+        super().bind(engine, primary_key="pk", table="column_test")
+
+
+def test_columns(engine: PWEngine):
+    ColumnTestModel.bind(engine)
+    ColumnTestModel.where().delete()
+    ColumnTestModel.save_many(
+        ColumnTestModel(
+            age=i,
+            score=i / 2 if i % 4 != 0 else None,
+            swims=i % 2 == 0,
+            nickname=None if i % 5 == 0 else f"n{i}",
+        )
+        for i in range(10)
+    )
+
+    columns = ColumnTestModel.where(age__lt=8).order_by("age").columns(
+        "age", "score", "swims", batch_size=3, as_numpy=False
+    )
+    assert columns["age"].typecode == "q"
+    assert list(columns["age"]) == list(range(8))
+    assert columns["score"][1] == 0.5
+    assert math.isnan(columns["score"][4])
+    assert list(columns["swims"]) == [1, 0] * 4
+
+    arrays = ColumnTestModel.columns("age", "swims")
+    if numpy is not None:
+        assert arrays["age"].dtype == numpy.int64
+        assert arrays["swims"].dtype == numpy.bool_
+        assert int(arrays["age"].sum()) == 45
+        assert int(arrays["swims"].sum()) == 5
+    else:
+        assert sum(arrays["age"]) == 45
+
+    for fields in ((), ("nickname",), ("wingspan",)):
+        try:
+            ColumnTestModel.columns(*fields)
+            assert False
+        except PWInvalidQueryError:
+            pass
+
+
+def test_bulk_writes(engine: PWEngine):
+    fill(engine)
+
+    # upserts matched on the primary key and on a unique column
+    duck = QueryTestModel.get(name="duck05")
+    QueryTestModel.upsert(
+        [
+            QueryTestModel(pk=duck.pk, name="duck05", age=50),
+            QueryTestModel(name="duck30", age=30),
+        ]
+    )
+    assert QueryTestModel.get(name="duck05").age == 50
+    assert QueryTestModel.get(name="duck30").pk is not None
+
+    ducks = [
+        QueryTestModel(name="duck06", age=60, color="white"),
+        QueryTestModel(name="duck31", age=31),
+    ]
+    QueryTestModel.upsert(ducks, conflict=["name"])
+    assert ducks[0].pk == QueryTestModel.get(name="duck06").pk
+    assert QueryTestModel.get(pk=ducks[0].pk).color == "white"
+    assert QueryTestModel.get(pk=ducks[1].pk).name == "duck31"
+    assert len(QueryTestModel.all()) == 32
+
+    # the upserted objects are bound to their rows
+    ducks[0].age = 61
+    ducks[0].save()
+    assert QueryTestModel.get(name="duck06").age == 61
+
+    try:
+        QueryTestModel.upsert(ducks, conflict=["wingspan"])
+        assert False
+    except PWInvalidQueryError:
+        pass
+
+    # NULL never conflicts, such rows could not be bound
+    try:
+        QueryTestModel.upsert(
+            [QueryTestModel(name="duck32", age=1)], conflict=["color"]
+        )
+        assert False
+    except PWInvalidQueryError:
+        pass
+    assert not QueryTestModel.exists(name="duck32")
+
+    assert QueryTestModel.where(age__gte=30).update(color="gold") == 4
+    assert len(QueryTestModel.where(color="gold").all()) == 4
+    assert QueryTestModel.where(age=100).update(color="gold") == 0
+
+    # limited writes only touch the rows the query selects
+    limited = QueryTestModel.where(color=None).order_by("name").limit(3)
+    assert limited.update(age=99) == 3
+    assert [x.name for x in QueryTestModel.where(age=99).order_by("name")] == [
+        "duck01",
+        "duck02",
+        "duck04",
+    ]
+
+    try:
+        QueryTestModel.where(age=99).update(pk=1)
+        assert False
+    except PWInvalidQueryError:
+        pass
+
+    assert QueryTestModel.where(age=99).delete() == 3
+    assert QueryTestModel.where(age__gte=30).delete() == 4
+    assert len(QueryTestModel.all()) == 25
+
+
+def main():
+    engine = PWEngineFactory.create_sqlite3_engine("test.db")
+    test_filters(engine)
+    test_paging(engine)
+    test_trusted(engine)
+    test_json(engine)
+    test_projection(engine)
+    test_aggregates(engine)
+    test_columns(engine)
+    test_bulk_writes(engine)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+from pwdantic.pwdantic import PWModel, PWEngineFactory, PWEngine, PWSession
+
+
+class RelationDuck(PWModel):
+    pk: int | None = None
+    name: str
+    children: list["RelationDuck"] = []
+
+    @classmethod
+    def bind(cls, engine):
+        super().bind(
+            engine,
+            primary_key="pk",
+            unique=["name"],
+            table="relation_duck",
+            relations={"children": None},
+        )
+
+
+class Frog(PWModel):
+    pk: int | None = None
+    name: str
+    pond_id: int | None = None
+
+    @classmethod
+    def bind(cls, engine):
+        super().bind(
+            engine,
+            primary_key="pk",
+            unique=["name"],
+            table="relation_frog",
+            indexes=[("pond_id",)],
+        )
+
+
+class Pond(PWModel):
+    pk: int | None = None
+    name: str
+    frogs: list[Frog] = []
+
+    @classmethod
+    def bind(cls, engine):
+        super().bind(
+            engine,
+            primary_key="pk",
+            unique=["name"],
+            table="relation_pond",
+            relations={"frogs": "pond_id"},
+        )
+
+
+def count_selects(engine: PWEngine, func) -> int:
+    selects = []
+    engine.conn.set_trace_callback(
+        lambda sql: selects.append(sql) if sql.startswith("SELECT") else None
+    )
+    try:
+        func()
+    finally:
+        engine.conn.set_trace_callback(None)
+    return len(selects)
+
+
+def test_link_table(engine: PWEngine):
+    RelationDuck.bind(engine)
+    for obj in RelationDuck.all():
+        obj.delete()
+
+    parents = []
+    for i in range(10):
+        children = [RelationDuck(name=f"child{i}-{x}") for x in range(3)]
+        parents.append(RelationDuck(name=f"parent{i}", children=children))
+    RelationDuck.save_many(parents)
+
+    # lazy by default, loaded on first access
+    parent = RelationDuck.get(name="parent3")
+    assert "children" not in parent.__dict__
+    assert [x.name for x in parent.children] == [
+        "child3-0",
+        "child3-1",
+        "child3-2",
+    ]
+
+    # children are stored once, changes show up through every parent
+    child = parent.children[1]
+    child.name = "renamed"
+    child.save()
+    assert RelationDuck.get(name="parent3").children[1].name == "renamed"
+
+    # one query for the parents, one for the links, one for the children
+    query = RelationDuck.where(name__in=[f"parent{i}" for i in range(10)])
+    loaded = []
+    assert count_selects(
+        engine, lambda: loaded.extend(query.prefetch("children").all())
+    ) == 3
+    assert count_selects(
+        engine, lambda: [x.children for x in loaded]
+    ) == 0
+    assert all(len(x.children) == 3 for x in loaded)
+
+    batches = list(query.prefetch("children").iter(batch_size=4))
+    assert all(len(x.children) == 3 for x in batches)
+
+    # reordering and removing rewrites the links of the parent only
+    parent = RelationDuck.get(name="parent3")
+    parent.children = parent.children[::-1][:2]
+    parent.save()
+    assert [x.name for x in RelationDuck.get(name="parent3").children] == [
+        "child3-2",
+        "renamed",
+    ]
+    assert len(RelationDuck.get(name="parent4").children) == 3
+
+    with PWSession():
+        parent = RelationDuck.get(name="parent5")
+        assert parent.children[0] is RelationDuck.get(name="child5-0")
+
+    parent.delete()
+    assert RelationDuck.get(name="child5-0") is not None
+
+    # deleted children are removed from the links of their parents
+    RelationDuck.get(name="child4-1").delete()
+    assert [x.name for x in RelationDuck.get(name="parent4").children] == [
+        "child4-0",
+        "child4-2",
+    ]
+    RelationDuck.where(name__in=["child6-0", "child6-2"]).delete()
+    assert [x.name for x in RelationDuck.get(name="parent6").children] == [
+        "child6-1",
+    ]
+    link_table = RelationDuck._relations["children"].link_table
+    keys = engine.conn.execute(
+        f"SELECT child FROM {link_table} WHERE child NOT IN "
+        "(SELECT pk FROM relation_duck)"
+    ).fetchall()
+    assert keys == []
+
+
+def test_foreign_key(engine: PWEngine):
+    Frog.bind(engine)
+    Pond.bind(engine)
+    for obj in Pond.all():
+        obj.delete()
+    for obj in Frog.all():
+        obj.delete()
+
+    Pond(name="big", frogs=[Frog(name="a"), Frog(name="b")]).save()
+    Pond(name="small", frogs=[Frog(name="c")]).save()
+
+    big = Pond.get(name="big")
+    assert [x.name for x in big.frogs] == ["a", "b"]
+    assert all(x.pond_id == big.pk for x in big.frogs)
+
+    ponds = Pond.where().order_by("name").prefetch("frogs").all()
+    assert [[x.name for x in pond.frogs] for pond in ponds] == [
+        ["a", "b"],
+        ["c"],
+    ]
+
+    # a frog moved into another pond
+    frog = Frog.get(name="c")
+    big.frogs.append(frog)
+    big.save()
+    assert [x.name for x in Pond.get(name="big").frogs] == ["a", "b", "c"]
+    assert Pond.get(name="small").frogs == []
+
+    # frogs removed from a pond, or whose pond is deleted, are unlinked
+    big = Pond.get(name="big")
+    big.frogs = big.frogs[:1]
+    big.save()
+    assert [x.name for x in Pond.get(name="big").frogs] == ["a"]
+    assert Frog.get(name="b").pond_id is None
+    assert Frog.get(name="c").pond_id is None
+
+    Pond.get(name="big").delete()
+    assert Frog.get(name="a").pond_id is None
+    assert Frog.count(pond_id=None) == 3
+
+    Pond(name="bulk", frogs=[Frog(name="d")]).save()
+    Pond.where(name="bulk").delete()
+    assert Frog.get(name="d").pond_id is None
+
+
+def main():
+    engine = PWEngineFactory.create_sqlite3_engine("test.db")
+    test_link_table(engine)
+    test_foreign_key(engine)
+
+
+if __name__ == "__main__":
+    main()